@@ -0,0 +1,254 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Asyncio wrappers around the molecule input and output streams.
+
+The blocking stream calls (opening files, parsing and writing molecules)
+run in batches on a single background thread per stream so that the event
+loop stays responsive, e.g.::
+
+    async with await aget_mol_input_stream("in.sdf") as inf, \\
+               await aget_mol_output_stream("out.sdf.gz") as out:
+        async for mol in inf:
+            await out.write_mol(mol)
+
+Any stream returned by get_mol_input_stream / get_mol_output_stream can be
+wrapped, so both toolkits are supported.
+"""
+
+import asyncio
+import functools
+import itertools
+import typing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream
+from cdd_chem.io import get_mol_input_stream, get_mol_output_stream
+from cdd_chem.mol import BaseMol
+
+
+class AsyncMolInputStream:
+    """Reads molecules from a BaseMolInputStream with ``async for``.
+
+       Batches of ``batch_size`` molecules are read on a background thread,
+       up to ``readahead`` batches are read ahead of the consumer.
+    """
+
+    def __init__(self, stream: BaseMolInputStream, batch_size: int = 64, readahead: int = 2,
+                 executor: Optional[ThreadPoolExecutor] = None) -> None:
+        """
+        Parameters
+        ----------
+        stream
+            input stream to read from, it is only accessed from the background thread
+        batch_size
+            number of molecules read per call into the background thread
+        readahead
+            maximum number of batches read but not yet consumed
+        executor
+            single threaded executor owning ``stream``, created if not given
+        """
+        if readahead < 1:
+            raise ValueError(f"readahead must be at least 1: {readahead}")
+        self.stream = stream
+        self._batch_size = batch_size
+        self._readahead = readahead
+        # a single thread keeps the batches in stream order
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self._pending: typing.Deque[asyncio.Future] = deque()
+        self._mols: typing.Deque[BaseMol] = deque()
+        self._at_end = False
+
+    def _read_batch(self) -> List[BaseMol]:
+        return list(itertools.islice(self.stream, self._batch_size))
+
+    def _fill(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._at_end and len(self._pending) < self._readahead:
+            self._pending.append(loop.run_in_executor(self._executor, self._read_batch))
+
+    async def has_next(self) -> bool:
+        """Checks whether the stream still has molecules."""
+        while not self._mols:
+            self._fill()
+            if not self._pending:
+                return False
+            batch = await self._pending.popleft()
+            if len(batch) < self._batch_size:
+                self._at_end = True
+            self._mols.extend(batch)
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> BaseMol:
+        if not await self.has_next():
+            raise StopAsyncIteration()
+        return self._mols.popleft()
+
+    async def close(self) -> None:
+        """Waits for batches being read and closes the underlying stream."""
+        self._at_end = True
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.cancel():
+                try:
+                    await future
+                except Exception: # pylint: disable=W0703
+                    pass
+        self._mols.clear()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.stream.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncMolOutputStream:
+    """Writes molecules to a BaseMolOutputStream with ``await write_mol()``.
+
+       Molecules are collected into batches of ``batch_size`` which are
+       written on a background thread; write_mol only waits when more than
+       ``max_pending`` batches are still being written. Errors raised while
+       writing a batch are raised by a later write_mol, flush or close.
+    """
+
+    def __init__(self, stream: BaseMolOutputStream, batch_size: int = 64, max_pending: int = 2,
+                 executor: Optional[ThreadPoolExecutor] = None) -> None:
+        """
+        Parameters
+        ----------
+        stream
+            output stream to write to, it is only accessed from the background thread
+        batch_size
+            number of molecules written per call into the background thread
+        max_pending
+            maximum number of batches waiting to be written
+        executor
+            single threaded executor owning ``stream``, created if not given
+        """
+        if max_pending < 1:
+            raise ValueError(f"max_pending must be at least 1: {max_pending}")
+        self.stream = stream
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self._pending: typing.Deque[asyncio.Future] = deque()
+        self._batch: List[BaseMol] = []
+        self._closed = False
+
+    async def _submit(self) -> None:
+        while len(self._pending) >= self._max_pending:
+            await self._pending.popleft()
+        batch, self._batch = self._batch, []
+        loop = asyncio.get_running_loop()
+        self._pending.append(loop.run_in_executor(self._executor, self.stream.write_mols, batch))
+
+    async def write_mol(self, mol: BaseMol) -> None:
+        """Queues mol for writing."""
+        if self._closed:
+            raise ValueError("write to closed stream")
+        self._batch.append(mol)
+        if len(self._batch) >= self._batch_size:
+            await self._submit()
+
+    async def flush(self) -> None:
+        """Waits until all molecules passed to write_mol have been written."""
+        if self._batch:
+            await self._submit()
+        while self._pending:
+            await self._pending.popleft()
+
+    async def close(self) -> None:
+        """Writes all queued molecules and closes the underlying stream."""
+        if self._closed:
+            return
+        self._closed = True
+        loop = asyncio.get_running_loop()
+        try:
+            await self.flush()
+        finally:
+            # close the stream even if a batch failed, the first error is raised
+            while self._pending:
+                try:
+                    await self._pending.popleft()
+                except Exception: # pylint: disable=W0703
+                    pass
+            try:
+                await loop.run_in_executor(self._executor, self.stream.close)
+            finally:
+                self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+async def aget_mol_input_stream(*args, batch_size: int = 64, readahead: int = 2,
+                                **kwargs) -> AsyncMolInputStream:
+    """Asyncio version of get_mol_input_stream.
+
+       The stream is opened on the background thread of the returned
+       AsyncMolInputStream.
+
+       Parameters
+       ----------
+       args, kwargs
+           passed to get_mol_input_stream
+       batch_size
+           number of molecules parsed per call into the background thread
+       readahead
+           maximum number of batches parsed ahead of the consumer
+
+       Returns
+       -------
+           stream supporting ``async for`` and ``async with``
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        stream = await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(get_mol_input_stream, *args, **kwargs))
+    except BaseException:
+        executor.shutdown(wait=False)
+        raise
+    return AsyncMolInputStream(stream, batch_size, readahead, executor)
+
+
+async def aget_mol_output_stream(*args, batch_size: int = 64, max_pending: int = 2,
+                                 **kwargs) -> AsyncMolOutputStream:
+    """Asyncio version of get_mol_output_stream.
+
+       The stream is opened on the background thread of the returned
+       AsyncMolOutputStream.
+
+       Parameters
+       ----------
+       args, kwargs
+           passed to get_mol_output_stream
+       batch_size
+           number of molecules written per call into the background thread
+       max_pending
+           maximum number of batches waiting to be written
+
+       Returns
+       -------
+           stream supporting ``await write_mol()`` and ``async with``
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        stream = await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(get_mol_output_stream, *args, **kwargs))
+    except BaseException:
+        executor.shutdown(wait=False)
+        raise
+    return AsyncMolOutputStream(stream, batch_size, max_pending, executor)
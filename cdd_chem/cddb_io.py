@@ -0,0 +1,188 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Binary molecule archive (.cddb) holding molecules in the native binary
+format of the toolkit (RDKit pickle, OEB) so that reloading a library does
+not need parsing, sanitization or perception.
+
+Layout of a .cddb file::
+
+    header   b"CDDB", version byte, toolkit name length byte, toolkit name
+    chunks   gzip members, each the concatenation of records
+             <uint32 little endian length><mol_to_binary() bytes>
+    table    int64 array: number of chunks n, n + 1 chunk offsets
+             (the last one is the offset of the table), n record counts
+    trailer  uint64 offset of the table, b"CDDB"
+
+The binary molecules include title and SD properties. An archive can only
+be read with the toolkit that wrote it.
+"""
+
+import io
+import os
+import struct
+import typing
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy
+
+from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream, _import_iomodule
+from cdd_chem.mol import BaseMol
+from cdd_chem.toolkit import get_toolkit
+from cdd_chem.util.block_compress import RecordBlockWriter
+from cdd_chem.util.parallel import ordered_map
+
+MAGIC = b"CDDB"
+VERSION = 1
+
+_LENGTH = struct.Struct("<I")
+_TRAILER = struct.Struct("<Q4s")
+
+
+class CDDBMolOutputStream(BaseMolOutputStream):
+    """Writes molecules to a .cddb archive with the current toolkit.
+
+       Records are collected into chunks of about ``chunk_size`` bytes which
+       are compressed on ``compress_threads`` threads.
+    """
+
+    def __init__(self, file_path: str, compress_threads: Optional[int] = None,
+                 compress_level: int = 1, chunk_size: int = 1 << 20) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            .cddb file
+        compress_threads
+            number of compression threads
+        compress_level
+            gzip compression level of the chunks
+        chunk_size
+            target number of uncompressed bytes per chunk
+        """
+        super().__init__(file_path)
+        self._io_module = _import_iomodule(get_toolkit())
+        self._raw = io.open(file_path, "wb") # pylint: disable=R1732
+        toolkit = get_toolkit().encode("UTF-8")
+        self._header_size = self._raw.write(MAGIC + bytes([VERSION, len(toolkit)]) + toolkit)
+        self._out = RecordBlockWriter(self._raw, "gzip", compress_level, compress_threads or 1,
+                                      chunk_size, close_raw=False)
+
+    def write_mol(self, mol: BaseMol):
+        """Writes molecule to stream."""
+        data = self._io_module.mol_to_binary(mol)
+        self._out.write(_LENGTH.pack(len(data)) + data)
+
+    def close(self):
+        """Writes the pending chunks and the offset table and closes the file."""
+        if self._raw.closed:
+            return
+        try:
+            self._out.close()
+            num_chunks = len(self._out.block_offsets) - 1
+            offsets = numpy.asarray(self._out.block_offsets, dtype=numpy.int64) + self._header_size
+            counts = numpy.bincount(numpy.asarray(self._out.record_blocks, dtype=numpy.int64),
+                                    minlength=num_chunks)
+            table = numpy.concatenate([[num_chunks], offsets, counts]).astype("<i8")
+            self._raw.write(table.tobytes())
+            self._raw.write(_TRAILER.pack(int(offsets[-1]), MAGIC))
+        finally:
+            self._raw.close()
+
+
+class CDDBMolInputStream(BaseMolInputStream):
+    """Reads molecules from a .cddb archive.
+
+       Chunks are decompressed and decoded into molecules on ``threads``
+       threads, in file order.
+    """
+
+    def __init__(self, file_path: str, threads: int = 1) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            .cddb file written with the current toolkit
+        threads
+            number of threads decoding chunks
+        """
+        super().__init__()
+        self.file_path = file_path
+        self._file = io.open(file_path, "rb") # pylint: disable=R1732
+        try:
+            self._read_table()
+        except BaseException:
+            self._file.close()
+            raise
+        self._io_module = _import_iomodule(get_toolkit())
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._chunks = ordered_map(self._executor, self._decode_chunk, range(self.num_chunks), 2 * threads)
+        self._mols: typing.Deque[BaseMol] = deque()
+        self.next_mol: Optional[BaseMol] = None
+
+    def _read_table(self) -> None:
+        header = self._file.read(6)
+        if len(header) < 6 or header[:4] != MAGIC:
+            raise ValueError(f"Not a cddb file: {self.file_path}")
+        if header[4] != VERSION:
+            raise ValueError(f"Unsupported cddb version {header[4]}: {self.file_path}")
+        toolkit = self._file.read(header[5]).decode("UTF-8")
+        if toolkit != get_toolkit():
+            raise ValueError(f"{self.file_path} was written with {toolkit}, current toolkit is {get_toolkit()}")
+
+        self._file.seek(-_TRAILER.size, os.SEEK_END)
+        table_offset, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Truncated cddb file: {self.file_path}")
+        self._file.seek(table_offset)
+        num_chunks = numpy.frombuffer(self._file.read(8), dtype="<i8")[0]
+        table = numpy.frombuffer(self._file.read(8 * (2 * num_chunks + 1)), dtype="<i8")
+        self.chunk_offsets = table[:num_chunks + 1]
+        self.chunk_records = table[num_chunks + 1:]
+
+    @property
+    def num_chunks(self) -> int:
+        """Number of chunks in the archive."""
+        return len(self.chunk_records)
+
+    def __len__(self) -> int:
+        return int(self.chunk_records.sum())
+
+    def _decode_chunk(self, chunk: int) -> List[BaseMol]:
+        start, end = int(self.chunk_offsets[chunk]), int(self.chunk_offsets[chunk + 1])
+        data = zlib.decompress(os.pread(self._file.fileno(), end - start, start), wbits=31)
+        mols = []
+        pos = 0
+        while pos < len(data):
+            length = _LENGTH.unpack_from(data, pos)[0]
+            pos += _LENGTH.size
+            mols.append(self._io_module.mol_from_binary(data[pos:pos + length]))
+            pos += length
+        return mols
+
+    def has_next(self) -> bool:
+        if self.next_mol is not None:
+            return True
+        while not self._mols:
+            mols = next(self._chunks, None)
+            if mols is None:
+                return False
+            self._mols.extend(mols)
+        self.next_mol = self._mols.popleft()
+        return True
+
+    def __next__(self) -> BaseMol:
+        if not self.has_next():
+            raise StopIteration()
+        res = typing.cast(BaseMol, self.next_mol)
+        self.next_mol = None
+        return res
+
+    def close(self) -> None:
+        typing.cast(typing.Generator, self._chunks).close()
+        self._executor.shutdown()
+        self._file.close()
+        self._mols.clear()
@@ -9,22 +9,46 @@ Module to provide input/output operations for the generic (toolkit agnostic)
 chemistry API.
 '"""
 
+import builtins
+import gzip
+import io
+import itertools
+import json
+import logging
+import mmap
+import os
+import queue
+import shutil
+import threading
 import typing
+import zlib
 
 from abc import ABCMeta
 from abc import abstractmethod
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from importlib import import_module
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Union
 
 import numpy
 import pandas
 from pandas import DataFrame
 
 from cdd_chem.mol import BaseMol, from_smiles
-from cdd_chem.toolkit import get_toolkit
+from cdd_chem.sd_record import SDRecord, parse_sd_record
+from cdd_chem.toolkit import cdd_toolkit, get_toolkit
 from cdd_chem.util.IterableAlgorithm import IterableAlgorithm
 from cdd_chem.util import bit_vector
+from cdd_chem.util.block_compress import BlockCompressWriter, RecordBlockWriter, compression_method, zstd_reader
+from cdd_chem.util.parallel import ordered_map
+from cdd_chem.util.sd_file import iter_sd_records, iter_sd_records_in_range, shard_byte_range
+from cdd_chem.util.sd_file import SDFileIndex, BlockSDFileIndex
+
+
+# extension of block compressed SD files, see BlockSDMolOutputStream
+BLOCK_SDF_SUFFIX = ".sdf.bgz"
+PARQUET_SUFFIX = ".parquet"
+CDDB_SUFFIX = ".cddb"
 
 
 class BaseMolInputStream(IterableAlgorithm[BaseMol], metaclass=ABCMeta):
@@ -51,6 +75,99 @@ class BaseMolInputStream(IterableAlgorithm[BaseMol], metaclass=ABCMeta):
         """Terminates the iterator and free the list of molecules."""
 
 
+class SDRandomAccessMixin:
+    """Adds ``num_records()``, ``stream[i]``, slicing and ``seek(i)`` to input
+       streams reading an uncompressed SD file.
+
+       The byte offsets of the records are taken from an SDFileIndex which
+       is built on first use and kept in a sidecar file for later runs.
+       Classes using this mixin must set ``file_path`` and ``next_mol`` and
+       call ``_next_seeked()`` from ``has_next()`` while ``_seek_record`` is
+       not None. Other indexed formats overwrite ``_num_records()`` and
+       ``_record_bytes()``.
+    """
+
+    file_path: str
+    next_mol: Optional[BaseMol]
+    _parse_kwargs: Dict = {}
+    _index: Optional[SDFileIndex] = None
+    _index_mmap: Optional[mmap.mmap] = None
+    _seek_record: Optional[int] = None
+
+    def _sd_index(self) -> SDFileIndex:
+        if self._index is None:
+            if not self.file_path.lower().endswith((".sdf", ".sd")) or not os.path.isfile(self.file_path):
+                raise TypeError(f"Random access requires an uncompressed SD file: {self.file_path}")
+            self._index = SDFileIndex.load_or_build(self.file_path)
+            if len(self._index) > 0:
+                with open(self.file_path, "rb") as in_f:
+                    self._index_mmap = mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._index
+
+    def _num_records(self) -> int:
+        return len(self._sd_index())
+
+    def _record_bytes(self, i: int) -> bytes:
+        start, end = self._sd_index().record_range(i)
+        return typing.cast(mmap.mmap, self._index_mmap)[start:end]
+
+    def _read_records(self, indices: typing.Iterable[int]) -> List[BaseMol]:
+        records = [self._record_bytes(i) for i in indices]
+        io_module = _import_iomodule(get_toolkit())
+        mols = list(io_module.mols_from_sd_records(records, **self._parse_kwargs))
+        if len(mols) != len(records):
+            raise ValueError(f"Could not parse all records of {self.file_path}")
+        return mols
+
+    def num_records(self) -> int:
+        """Returns the number of records, building the index if needed.
+
+           This is a method instead of ``__len__`` so that ``list(stream)``
+           and ``bool(stream)`` do not build an index.
+        """
+        return self._num_records()
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[BaseMol, List[BaseMol]]:
+        """Returns molecule ``i`` or a list of molecules for a slice."""
+        num_records = self._num_records()
+        if isinstance(i, slice):
+            return self._read_records(range(*i.indices(num_records)))
+        if i < 0:
+            i += num_records
+        if not 0 <= i < num_records:
+            raise IndexError(f"record index {i} out of range")
+        return self._read_records([i])[0]
+
+    def seek(self, i: int) -> None:
+        """Position the stream so that the next molecule returned is record ``i``."""
+        num_records = self._num_records()
+        if i < 0:
+            i += num_records
+        if not 0 <= i <= num_records:
+            raise IndexError(f"record index {i} out of range")
+        self.next_mol = None
+        self._seek_to(i)
+
+    def _seek_to(self, i: int) -> None:
+        """Overwrite to reposition the native reader, the default reads
+           record by record from the index.
+        """
+        self._seek_record = i
+
+    def _next_seeked(self) -> Optional[BaseMol]:
+        """Returns the molecule at the current seek position and advances."""
+        i = typing.cast(int, self._seek_record)
+        if i >= self._num_records():
+            return None
+        self._seek_record = i + 1
+        return self._read_records([i])[0]
+
+    def _close_index(self) -> None:
+        if self._index_mmap is not None:
+            self._index_mmap.close()
+            self._index_mmap = None
+
+
 class MemMolStream(BaseMolInputStream):
     """Molecule stream that holds a list of molecules in memory."""
 
@@ -131,6 +248,91 @@ class MemMolStream(BaseMolInputStream):
         self._mols.clear()
 
 
+class BoundedMemMolStream(MemMolStream):
+    """Thread safe MemMolStream of bounded size for handing molecules from
+       producer threads to a consumer thread.
+
+       add_mol blocks while the stream holds ``maxsize`` molecules and
+       has_next blocks while it is empty until a molecule is added or
+       close_input() signals that no more molecules will be added. close()
+       drops the queued molecules; producers blocked in or later calling
+       add_mol get a ValueError.
+    """
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        """
+        Parameters
+        ----------
+        maxsize
+            maximum number of molecules held by the stream
+        """
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1: {maxsize}")
+        super().__init__()
+        self.maxsize = maxsize
+        self._cond = threading.Condition()
+        self._input_closed = False
+        self._closed = False
+
+    def add_mol(self, mol: BaseMol, timeout: Optional[float] = None) -> None:
+        """Append a molecule, waiting while the stream is full.
+
+        Parameters
+        ----------
+        mol
+            Molecule to append.
+        timeout
+            maximum number of seconds to wait, None to wait until there
+            is room
+
+        Raises
+        ------
+        ValueError
+            if close_input() or close() was called
+        TimeoutError
+            if the stream is still full after timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._mols) < self.maxsize or self._closed
+                                       or self._input_closed, timeout):
+                raise TimeoutError(f"stream still full after {timeout} s")
+            if self._closed or self._input_closed:
+                raise ValueError("add_mol to closed stream")
+            self._mols.append(mol)
+            self._cond.notify_all()
+
+    def close_input(self) -> None:
+        """Signal that no more molecules will be added; the consumer reads
+           the remaining molecules and then stops.
+        """
+        with self._cond:
+            self._input_closed = True
+            self._cond.notify_all()
+
+    def has_next(self) -> bool:
+        """Checks whether the stream still has molecules, waiting until a
+           molecule is added or the input is closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._mols or self._input_closed or self._closed)
+            return len(self._mols) > 0
+
+    def __next__(self) -> BaseMol:
+        with self._cond:
+            if not self.has_next():
+                raise StopIteration()
+            mol = self._mols.popleft()
+            self._cond.notify_all()
+            return mol
+
+    def close(self) -> None:
+        """Drops the queued molecules and releases waiting producers."""
+        with self._cond:
+            self._closed = True
+            self._mols.clear()
+            self._cond.notify_all()
+
+
 class BaseMolOutputStream(metaclass=ABCMeta):
     """Molecule output stream for writing molecules to file using the OpenEye toolkit."""
 
@@ -142,6 +344,11 @@ class BaseMolOutputStream(metaclass=ABCMeta):
         """Writes molecule to stream."""
         pass # pylint: disable=W0107
 
+    def write_mols(self, mols: typing.Iterable[BaseMol]) -> None:
+        """Writes all molecules to stream."""
+        for mol in mols:
+            self.write_mol(mol)
+
     def __enter__(self):
         return self
 
@@ -153,26 +360,756 @@ class BaseMolOutputStream(metaclass=ABCMeta):
         """Closes output stream."""
 
 
-def get_mol_input_stream(*args, **kwargs) -> BaseMolInputStream:
+class BackgroundMolOutputStream(BaseMolOutputStream):
+    """Writes molecules to another output stream on a background thread.
+
+       Molecules are queued in batches of ``batch_size``; the writer thread
+       serializes and writes them so that the producer can continue
+       computing. write_mol blocks only when ``queue_size`` batches are
+       waiting. Molecules must not be modified after they are passed to
+       write_mol. An error raised by the writer thread is raised by all
+       following write_mol/write_mols calls and by close; molecules queued
+       after the error are not written.
+    """
+
+    def __init__(self, stream: BaseMolOutputStream, queue_size: int = 4, batch_size: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        stream
+            output stream, only accessed from the writer thread until closed
+        queue_size
+            maximum number of batches waiting to be written
+        batch_size
+            number of molecules per batch
+        """
+        super().__init__(stream.file_path)
+        self.stream = stream
+        self._batch_size = batch_size
+        self._batch: List[BaseMol] = []
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"mol writer {self.file_path}", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            if self._error is None:
+                try:
+                    self.stream.write_mols(batch)
+                except BaseException as exc: # pylint: disable=W0703
+                    # keep draining the queue so that producers do not block
+                    self._error = exc
+
+    def _raise_error(self) -> None:
+        # the error is kept: later batches are discarded and close raises it again
+        if self._error is not None:
+            raise self._error
+
+    def _put_batch(self) -> None:
+        batch, self._batch = self._batch, []
+        self._queue.put(batch)
+
+    def write_mol(self, mol: BaseMol):
+        """Queues molecule for writing."""
+        if self._closed:
+            raise ValueError(f"write to closed stream: {self.file_path}")
+        self._raise_error()
+        self._batch.append(mol)
+        if len(self._batch) >= self._batch_size:
+            self._put_batch()
+
+    def write_mols(self, mols: typing.Iterable[BaseMol]) -> None:
+        """Queues all molecules for writing."""
+        for mol in mols:
+            self.write_mol(mol)
+
+    def close(self):
+        """Writes all queued molecules, closes the output stream and raises
+           any error of the writer thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._batch:
+            self._put_batch()
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self.stream.close()
+        finally:
+            self._raise_error()
+
+
+class _SDRecordSource:
+    """Opens an .sdf or .sdf.gz file and provides an iterator over its
+       records, optionally restricted to one shard of the file.
+    """
+
+    def __init__(self, file_path: str,
+                 shard: Optional[int] = None, num_shards: Optional[int] = None) -> None:
+        if (shard is None) != (num_shards is None):
+            raise ValueError("shard and num_shards must be given together")
+        compressed = file_path.lower().endswith((".sdf.gz", BLOCK_SDF_SUFFIX))
+        if not compressed and not file_path.lower().endswith(".sdf"):
+            raise ValueError(f"Only SD files can be read record by record: {file_path}")
+
+        self._file: typing.BinaryIO = io.open(file_path, "rb") # pylint: disable=R1732
+        self._stream: Optional[typing.BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self.records: typing.Iterator[bytes]
+        if shard is None:
+            if compressed:
+                self._stream = gzip.open(self._file, "rb") # type: ignore # pylint: disable=R1732
+            self.records = iter_sd_records(self._stream or self._file)
+        else:
+            if compressed:
+                raise ValueError(f"Sharded reading requires an uncompressed SD file: {file_path}")
+            if os.fstat(self._file.fileno()).st_size == 0:
+                self.records = iter(())
+            else:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                start, end = shard_byte_range(self._mmap, shard, typing.cast(int, num_shards))
+                self.records = iter_sd_records_in_range(self._mmap, start, end)
+
+    def close(self) -> None:
+        """Closes the underlying file."""
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._stream is not None:
+            self._stream.close()
+        self._file.close()
+
+
+class SDRecordMolInputStream(BaseMolInputStream):
+    """Read molecules from an SD file by splitting it into records and
+       parsing batches of records with the current toolkit.
+
+       This allows reading just one shard of a file, see shard_byte_range.
+    """
+
+    def __init__(self, file_path: str, shard: Optional[int] = None, num_shards: Optional[int] = None,
+                 batch_size: int = 64, **kwargs) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            path to .sdf or .sdf.gz file
+        shard
+            0 based number of the shard to read; requires num_shards
+        num_shards
+            number of shards the file is split into
+        batch_size
+            number of records parsed at a time
+        kwargs
+            passed to the toolkit parser, e.g. sanitize for RDKit
+        """
+        super().__init__()
+
+        self.file_path = file_path
+        self._source = _SDRecordSource(file_path, shard, num_shards)
+        self._io_module = _import_iomodule(get_toolkit())
+        self._batch_size = batch_size
+        self._kwargs = kwargs
+        self._batch: typing.Deque[BaseMol] = deque()
+
+    def has_next(self) -> bool:
+        while len(self._batch) == 0:
+            records = list(itertools.islice(self._source.records, self._batch_size))
+            if not records:
+                return False
+            self._batch.extend(self._io_module.mols_from_sd_records(records, **self._kwargs))
+        return True
+
+    def __next__(self) -> BaseMol:
+        if not self.has_next():
+            raise StopIteration()
+        return self._batch.popleft()
+
+    def close(self) -> None:
+        self._source.close()
+        self._batch.clear()
+
+
+class RawSDRecordInputStream(BaseMolInputStream):
+    """Read SDRecord objects from an .sdf or .sdf.gz file without building
+       toolkit molecules.
+
+       The records give access to title and SD tags; a toolkit molecule is
+       only created when a structural property of a record is accessed.
+    """
+
+    def __init__(self, file_path: str,
+                 shard: Optional[int] = None, num_shards: Optional[int] = None) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            path to .sdf or .sdf.gz file
+        shard
+            0 based number of the shard to read; requires num_shards
+        num_shards
+            number of shards the file is split into
+        """
+        super().__init__()
+
+        self.file_path = file_path
+        self._source = _SDRecordSource(file_path, shard, num_shards)
+        self.next_mol: Optional[SDRecord] = None
+
+    def has_next(self) -> bool:
+        if self.next_mol is not None:
+            return True
+        record = next(self._source.records, None)
+        if record is None:
+            return False
+        self.next_mol = parse_sd_record(record)
+        return True
+
+    def __next__(self) -> SDRecord:
+        if not self.has_next():
+            raise StopIteration()
+        res = typing.cast(SDRecord, self.next_mol)
+        self.next_mol = None
+        return res
+
+    def close(self) -> None:
+        self._source.close()
+
+
+class BlockSDMolInputStream(SDRandomAccessMixin, BaseMolInputStream):
+    """Read molecules from a block compressed SD file (.sdf.bgz).
+
+       The file is a sequence of gzip members each holding complete records,
+       see BlockSDMolOutputStream. Using the BlockSDFileIndex of the file,
+       blocks are decompressed ahead of the parser on a thread pool and
+       records can be read by number with num_records(), indexing, slicing
+       and seek().
+    """
+
+    def __init__(self, file_path: str, threads: int = 1, **kwargs) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            path to .sdf.bgz file
+        threads
+            number of threads decompressing blocks
+        kwargs
+            passed to the toolkit parser, e.g. sanitize for RDKit
+        """
+        super().__init__()
+
+        self.file_path = file_path
+        self._parse_kwargs = kwargs
+        self._io_module = _import_iomodule(get_toolkit())
+        self._block_index = BlockSDFileIndex.load_or_build(file_path)
+        self._file = io.open(file_path, "rb") # pylint: disable=R1732
+        self._threads = threads
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._cached_block: typing.Tuple[int, bytes] = (-1, b"")
+        self._batches: Optional[typing.Generator[List[bytes], None, None]] = None
+        self._mols: typing.Deque[BaseMol] = deque()
+        self.next_mol: Optional[BaseMol] = None
+        self._seek_to(0)
+
+    def _read_block(self, block: int) -> bytes:
+        start, end = self._block_index.block_range(block)
+        return zlib.decompress(os.pread(self._file.fileno(), end - start, start), wbits=31)
+
+    def _block_record_bytes(self, block: int, data: bytes, i: int) -> bytes:
+        start = int(self._block_index.record_offsets[i])
+        end = (int(self._block_index.record_offsets[i + 1])
+               if i + 1 < self._block_index.block_records[block + 1] else len(data))
+        return data[start:end]
+
+    def _iter_batches(self, first_record: int) -> typing.Generator[List[bytes], None, None]:
+        index = self._block_index
+        first_block = index.record_location(first_record)[0] if first_record < len(index) else index.num_blocks
+        blocks = range(first_block, index.num_blocks)
+        decompressed = ordered_map(self._executor, self._read_block, blocks, 2 * self._threads)
+        try:
+            for block, data in zip(blocks, decompressed):
+                start = max(first_record, int(index.block_records[block]))
+                yield [self._block_record_bytes(block, data, i)
+                       for i in range(start, int(index.block_records[block + 1]))]
+        finally:
+            decompressed.close()
+
+    def _num_records(self) -> int:
+        return len(self._block_index)
+
+    def _record_bytes(self, i: int) -> bytes:
+        block = self._block_index.record_location(i)[0]
+        if self._cached_block[0] != block:
+            self._cached_block = (block, self._read_block(block))
+        return self._block_record_bytes(block, self._cached_block[1], i)
+
+    def _seek_to(self, i: int) -> None:
+        if self._batches is not None:
+            self._batches.close()
+        self._mols.clear()
+        self._batches = self._iter_batches(i)
+
+    def has_next(self) -> bool:
+        if self.next_mol is not None:
+            return True
+        while len(self._mols) == 0:
+            records = next(typing.cast(typing.Iterator, self._batches), None)
+            if records is None:
+                return False
+            self._mols.extend(self._io_module.mols_from_sd_records(records, **self._parse_kwargs))
+        self.next_mol = self._mols.popleft()
+        return True
+
+    def __next__(self) -> BaseMol:
+        if not self.has_next():
+            raise StopIteration()
+        res = typing.cast(BaseMol, self.next_mol)
+        self.next_mol = None
+        return res
+
+    def close(self) -> None:
+        if self._batches is not None:
+            self._batches.close()
+            self._batches = None
+        self._executor.shutdown()
+        self._file.close()
+        self._mols.clear()
+
+
+class ParallelMolInputStream(BaseMolInputStream):
+    """Read molecules from an SD file parsing them on a pool of processes.
+
+       The calling process splits the file into $$$$ delimited records and
+       sends batches of records to the worker processes. Parsed molecules
+       are returned in input order; at most ``window`` batches are in flight
+       so the memory used for reordering stays bounded.
+    """
+
+    def __init__(self, file_path: str, workers: int,
+                 batch_size: int = 256, window: Optional[int] = None,
+                 shard: Optional[int] = None, num_shards: Optional[int] = None, **kwargs) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            path to .sdf or .sdf.gz file
+        workers
+            number of worker processes
+        batch_size
+            number of records sent to a worker at a time
+        window
+            maximum number of batches in flight, defaults to 4 * workers
+        shard
+            0 based number of the shard to read; requires num_shards
+        num_shards
+            number of shards the file is split into
+        kwargs
+            passed to the toolkit parser, e.g. sanitize for RDKit
+        """
+        super().__init__()
+
+        self.file_path = file_path
+        self._toolkit = get_toolkit()
+        self._io_module = _import_iomodule(self._toolkit)
+        self._source = _SDRecordSource(file_path, shard, num_shards)
+
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        records = self._source.records
+        batches = iter(lambda: list(itertools.islice(records, batch_size)), [])
+        task = _BatchParser(self._toolkit, kwargs)
+        self._results = ordered_map(self._executor, task, batches,
+                                    window if window is not None else 4 * workers)
+        self._batch: typing.Deque[bytes] = deque()
+
+    def has_next(self) -> bool:
+        while len(self._batch) == 0:
+            try:
+                self._batch.extend(next(self._results))
+            except StopIteration:
+                return False
+        return True
+
+    def __next__(self) -> BaseMol:
+        if not self.has_next():
+            raise StopIteration()
+        return self._io_module.mol_from_binary(self._batch.popleft())
+
+    def close(self) -> None:
+        self._results.close()
+        self._executor.shutdown()
+        self._source.close()
+        self._batch.clear()
+
+
+class _BatchParser:
+    """Picklable callable that parses a batch of SD records in a worker
+       process and returns the molecules in the toolkits binary format.
+    """
+
+    def __init__(self, toolkit: str, kwargs: Dict) -> None:
+        self.toolkit = toolkit
+        self.kwargs = kwargs
+
+    def __call__(self, records: List[bytes]) -> List[bytes]:
+        io_module = _import_iomodule(self.toolkit)
+        return [io_module.mol_to_binary(mol)
+                for mol in io_module.mols_from_sd_records(records, **self.kwargs)]
+
+
+class BlockSDMolOutputStream(BaseMolOutputStream):
+    """Write molecules to a block compressed SD file (.sdf.bgz).
+
+       Records are collected into blocks of about ``block_size`` bytes, each
+       block is compressed into its own gzip member so that the file can be
+       read by any gzip reader. A BlockSDFileIndex mapping record numbers to
+       blocks is written next to the file on close which allows reading
+       single records and decompressing the file in parallel, see
+       BlockSDMolInputStream.
+    """
+
+    def __init__(self, file_path: str, compress_threads: Optional[int] = None,
+                 compress_level: Optional[int] = None, block_size: int = 1 << 16) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            path to .sdf.bgz file
+        compress_threads
+            number of compression threads
+        compress_level
+            gzip compression level
+        block_size
+            target number of uncompressed bytes per block
+        """
+        super().__init__(file_path)
+        self._io_module = _import_iomodule(get_toolkit())
+        self._out = RecordBlockWriter(io.open(file_path, "wb"), "gzip", # pylint: disable=R1732
+                                      compress_level, compress_threads or 1, block_size)
+
+    def write_mol(self, mol: BaseMol):
+        """Writes molecule to stream."""
+        self._out.write(_sd_record_text(self._io_module, mol).encode("UTF-8"))
+
+    def close(self):
+        """Closes output stream and writes the index."""
+        if self._out.closed:
+            return
+        self._out.close()
+        BlockSDFileIndex(self.file_path, self._out.block_offsets,
+                         self._out.record_blocks, self._out.record_offsets).save()
+
+
+class CheckpointMolInputStream(BaseMolInputStream):
+    """Wraps an input stream counting the molecules read so that a
+       CheckpointMolOutputStream can record the input position and skip the
+       input ahead on resume.
+    """
+
+    def __init__(self, stream: BaseMolInputStream) -> None:
+        """
+        Parameters
+        ----------
+        stream
+            input stream to read from
+        """
+        super().__init__()
+        self.stream = stream
+        self.records_read = 0
+
+    def has_next(self) -> bool:
+        return self.stream.has_next()
+
+    def __next__(self) -> BaseMol:
+        mol = next(self.stream)
+        self.records_read += 1
+        return mol
+
+    def skip_to(self, i: int) -> None:
+        """Position the stream after the first ``i`` records, using seek()
+           if the stream supports random access and reading otherwise.
+        """
+        if i < self.records_read:
+            raise ValueError(f"{i} records requested but already read {self.records_read}")
+        if hasattr(self.stream, "seek"):
+            try:
+                self.stream.seek(i) # type: ignore
+                self.records_read = i
+                return
+            except TypeError:
+                pass # not an uncompressed SD file
+        while self.records_read < i:
+            try:
+                next(self)
+            except StopIteration:
+                raise ValueError(f"input has only {self.records_read} records, checkpoint needs {i}") from None
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+class CheckpointMolOutputStream(BaseMolOutputStream):
+    """Writes molecules to an uncompressed SD file recording checkpoints
+       so that a killed pipeline can be resumed, e.g.::
+
+           with CheckpointMolInputStream(get_mol_input_stream("in.sdf.gz")) as inp, \\
+                CheckpointMolOutputStream("out.sdf", inp, resume=True) as out:
+               for mol in inp:
+                   out.write_mol(process(mol))
+
+       Every ``checkpoint_every`` molecules the file is flushed and fsynced
+       and the number of records read from ``input_stream`` together with
+       the file length are written to the sidecar file ``<file_path>.ckpt``.
+       With ``resume=True`` and an existing checkpoint the file is truncated
+       to the recorded length, the input is skipped ahead to the recorded
+       record and writing continues at the end of the file. The checkpoint
+       is removed when the stream is closed without an exception.
+
+       The recorded input position is the number of molecules returned by
+       input_stream, stages reading ahead of the writer (PrefetchAlgorithm,
+       ParallelMapAlgorithm, BatchingAlgorithm) must therefore not be used
+       between them, otherwise molecules read ahead at a checkpoint are
+       skipped on resume. Pipelines reading ahead can call checkpoint()
+       with the number of input records whose output has been written.
+    """
+
+    CHECKPOINT_SUFFIX = ".ckpt"
+
+    def __init__(self, file_path: str, input_stream: Optional[CheckpointMolInputStream] = None,
+                 checkpoint_every: int = 1000, resume: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            .sdf file
+        input_stream
+            input whose position is recorded, None to call checkpoint()
+            explicitly
+        checkpoint_every
+            number of molecules written between checkpoints
+        resume
+            continue from the checkpoint of an earlier run if there is
+            one, otherwise the file is overwritten
+        """
+        super().__init__(file_path)
+        if not file_path.lower().endswith(".sdf"):
+            raise ValueError(f"Checkpoints require an uncompressed SD file: {file_path}")
+        if checkpoint_every < 1:
+            raise ValueError(f"checkpoint_every must be at least 1: {checkpoint_every}")
+        self.checkpoint_path = file_path + CheckpointMolOutputStream.CHECKPOINT_SUFFIX
+        self.input_stream = input_stream
+        self._checkpoint_every = checkpoint_every
+        self._io_module = _import_iomodule(get_toolkit())
+        self._since_checkpoint = 0
+        # input position recorded by the last checkpoint of this or an earlier run
+        self.input_records = 0
+
+        state = self._read_checkpoint() if resume else None
+        if state is None:
+            self._out = io.open(file_path, "wb") # pylint: disable=R1732
+        else:
+            self._out = io.open(file_path, "r+b") # pylint: disable=R1732
+            self._out.truncate(state["output_length"])
+            self._out.seek(state["output_length"])
+            self.input_records = state["input_records"]
+            if input_stream is not None:
+                input_stream.skip_to(self.input_records)
+
+    def _read_checkpoint(self) -> Optional[Dict[str, int]]:
+        if not os.path.exists(self.checkpoint_path) or not os.path.exists(self.file_path):
+            return None
+        with open(self.checkpoint_path, "rt", encoding="UTF-8") as in_f:
+            state = json.load(in_f)
+        if os.path.getsize(self.file_path) < state["output_length"]:
+            raise ValueError(f"{self.file_path} is shorter than recorded in {self.checkpoint_path}")
+        return state
+
+    def write_mol(self, mol: BaseMol):
+        """Writes molecule to stream."""
+        self._out.write(_sd_record_text(self._io_module, mol).encode("UTF-8"))
+        self._since_checkpoint += 1
+        if self.input_stream is not None and self._since_checkpoint >= self._checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self, input_records: Optional[int] = None) -> None:
+        """Flush and fsync the file and record the checkpoint.
+
+        Parameters
+        ----------
+        input_records
+            number of input records whose output has been written, defaults
+            to the records read from input_stream
+        """
+        if input_records is None:
+            if self.input_stream is None:
+                raise ValueError("input_records is required without input_stream")
+            input_records = self.input_stream.records_read
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        state = {"input_records": input_records, "output_length": self._out.tell()}
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "wt", encoding="UTF-8") as out:
+            json.dump(state, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self.input_records = input_records
+        self._since_checkpoint = 0
+
+    def close(self):
+        """Closes the file and removes the checkpoint."""
+        if self._out.closed:
+            return
+        self._out.close()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def __exit__(self, *args):
+        if args and args[0] is not None:
+            # keep the last checkpoint to resume from
+            self._out.close()
+            return
+        self.close()
+
+
+def _sd_record_text(io_module, mol: BaseMol) -> str:
+    """Returns the SD record of mol, SDRecords that have not been parsed are
+       written as they are.
+    """
+    if isinstance(mol, SDRecord) and not mol.is_parsed:
+        return mol.sdf_record
+    return io_module.mol_to_sd_record(mol)
+
+
+def get_mol_input_stream(*args, workers: Optional[int] = None,
+                         shard: Optional[int] = None, num_shards: Optional[int] = None,
+                         **kwargs) -> BaseMolInputStream:
     """Create an input stream for molecules.
         Depending on the TOOLKIT variable this will be either RDKit or Openeye.
+
+        If ``workers`` is given the SD file is parsed on that many
+        processes, see ParallelMolInputStream.
+
+        If ``shard`` and ``num_shards`` are given only the records of shard
+        ``shard`` out of ``num_shards`` byte ranges of an uncompressed SD file
+        are read, see shard_byte_range. Use merge_shard_outputs to combine
+        the per shard output files in input order.
+
+        Block compressed SD files (.sdf.bgz) are read with
+        BlockSDMolInputStream, Parquet files (.parquet) with
+        cdd_chem.parquet_io.ParquetMolInputStream and binary archives (.cddb)
+        with cdd_chem.cddb_io.CDDBMolInputStream for either toolkit.
     """
 
+    if workers:
+        return ParallelMolInputStream(*args, workers=workers, shard=shard, num_shards=num_shards, **kwargs)
+    if shard is not None or num_shards is not None:
+        return SDRecordMolInputStream(*args, shard=shard, num_shards=num_shards, **kwargs)
+    if args and args[0].lower().endswith(BLOCK_SDF_SUFFIX):
+        return BlockSDMolInputStream(*args, **kwargs)
+    if args and args[0].lower().endswith(PARQUET_SUFFIX):
+        parquet_io = import_module("cdd_chem.parquet_io")   # avoid circular import
+        return parquet_io.ParquetMolInputStream(*args, **kwargs)
+    if args and args[0].lower().endswith(CDDB_SUFFIX):
+        cddb_io = import_module("cdd_chem.cddb_io")   # avoid circular import
+        return cddb_io.CDDBMolInputStream(*args, **kwargs)
+
     io_module = _import_iomodule(get_toolkit())
     instance = io_module.MolInputStream(*args, **kwargs)
     return instance
 
 
-def get_mol_output_stream(*args, **kwargs) -> BaseMolOutputStream:
+def get_mol_output_stream(*args, writer_queue_size: Optional[int] = None, **kwargs) -> BaseMolOutputStream:
     """Create an output stream for molecules.
        Depending on the TOOLKIT variable this will be either RDKit or Openeye.
-    """
 
-    io_module = _import_iomodule(get_toolkit())
-    instance = io_module.MolOutputStream(*args, **kwargs)
+       If ``writer_queue_size`` is given the molecules are serialized and
+       written on a background thread with a queue of at most that many
+       batches, see BackgroundMolOutputStream.
+
+       Compressed output (.gz, .zst) can be compressed on several threads by
+       passing ``compress_threads`` and optionally ``compress_level``, see
+       cdd_chem.util.block_compress.
+
+       Block compressed SD files (.sdf.bgz) are written with
+       BlockSDMolOutputStream, Parquet files (.parquet) with
+       cdd_chem.parquet_io.ParquetMolOutputStream and binary archives (.cddb)
+       with cdd_chem.cddb_io.CDDBMolOutputStream for either toolkit.
+    """
+    instance: BaseMolOutputStream
+    if args and args[0].lower().endswith(BLOCK_SDF_SUFFIX):
+        instance = BlockSDMolOutputStream(*args, **kwargs)
+    elif args and args[0].lower().endswith(PARQUET_SUFFIX):
+        parquet_io = import_module("cdd_chem.parquet_io")   # avoid circular import
+        instance = parquet_io.ParquetMolOutputStream(*args, **kwargs)
+    elif args and args[0].lower().endswith(CDDB_SUFFIX):
+        cddb_io = import_module("cdd_chem.cddb_io")   # avoid circular import
+        instance = cddb_io.CDDBMolOutputStream(*args, **kwargs)
+    else:
+        io_module = _import_iomodule(get_toolkit())
+        instance = io_module.MolOutputStream(*args, **kwargs)
+    if writer_queue_size is not None:
+        instance = BackgroundMolOutputStream(instance, queue_size=writer_queue_size)
     return instance
 
 
+def mol_from_sd_record(record: bytes, **kwargs) -> BaseMol:
+    """Create a molecule with the current toolkit from the text of one SD record.
+
+       Parameters
+       ----------
+       record
+           SD record including its $$$$ line
+       kwargs
+           passed to the toolkit parser, e.g. sanitize for RDKit
+    """
+    mols = list(_import_iomodule(get_toolkit()).mols_from_sd_records([record], **kwargs))
+    if len(mols) != 1:
+        raise ValueError("Could not parse SD record")
+    return mols[0]
+
+
+def merge_shard_outputs(shard_paths: typing.Sequence[str], file_path: str) -> None:
+    """Concatenate the output files written for each shard into one file.
+
+       Because each shard holds a contiguous range of records and the shard
+       outputs are concatenated in shard order, the molecules end up in
+       the order of the original input.
+
+       Parameters
+       ----------
+       shard_paths
+           output files in shard order; .gz and .zst files are decompressed
+           unless ``file_path`` is compressed the same way
+       file_path
+           file to write, compressed if ending in .gz or .zst
+    """
+    out_method = compression_method(file_path)
+    with io.open(file_path, "wb") as out:
+        for shard_path in shard_paths:
+            in_method = compression_method(shard_path)
+            with io.open(shard_path, "rb") as raw_in:
+                if in_method == out_method:
+                    # gzip members and zstd frames may be concatenated as they are
+                    shutil.copyfileobj(raw_in, out)
+                    continue
+                in_s: typing.BinaryIO = raw_in
+                if in_method == "gzip":
+                    in_s = typing.cast(typing.BinaryIO, gzip.GzipFile(fileobj=raw_in, mode="rb"))
+                elif in_method == "zstd":
+                    in_s = zstd_reader(raw_in)
+                if out_method is None:
+                    shutil.copyfileobj(in_s, out)
+                else:
+                    with BlockCompressWriter(out, out_method, close_raw=False) as compressed:
+                        shutil.copyfileobj(in_s, compressed)
+
+
 def _import_iomodule(toolkit: str):
     if toolkit == "openeye":
         io_module = import_module("cdd_chem.oechem.io")
@@ -191,12 +1128,19 @@ def dataframe_to_sd_file(dataframe: DataFrame,
                          id_column: str,
                          file_path: str,
                          fingerprint_sd_field_name: Optional[str] = None,
-                         fingerprint_column_prefix: Optional[str] = None) -> None:
+                         fingerprint_column_prefix: Optional[str] = None,
+                         workers: Optional[int] = None,
+                         chunk_size: int = 1000) -> None:
     """Write compounds and associated descriptor data from pandas
        DataFrame to SD file, if a fingerprint is included
        (implied by providing fingerprint_column_prefix)
        write a base64 encoded representation of the fingerprint
 
+       If ``workers`` is given the frame is split into chunks of
+       ``chunk_size`` rows whose SD text is formatted in ``workers``
+       processes; the chunks are written in order to the output file,
+       which must be an .sdf file, optionally .gz or .zst compressed.
+
        Parameters
        ----------
        dataframe
@@ -211,12 +1155,27 @@ def dataframe_to_sd_file(dataframe: DataFrame,
            tag for writing fingerprint to sd file
        fingerprint_column_prefix
            prefix of columns containing fingerprint bits
+       workers
+           number of processes formatting chunks, None to write on the
+           calling thread
+       chunk_size
+           number of rows per chunk
 
        Returns
        -------
            None
+
+       Raises
+       ------
+       ValueError
+           if ``workers`` is given for another output format
     """
-    print(f"HERE: TOOLKIT={get_toolkit()}")
+    if workers:
+        _dataframe_to_sd_file_parallel(dataframe, smiles_column, id_column, file_path,
+                                       fingerprint_sd_field_name, fingerprint_column_prefix,
+                                       workers, chunk_size)
+        return
+
     field_index = {kee: i for i, kee in enumerate(list(dataframe))}
     with get_mol_output_stream(file_path) as writer:
         fingerprint_fields = []
@@ -243,26 +1202,106 @@ def dataframe_to_sd_file(dataframe: DataFrame,
             writer.write_mol(the_mol)
 
 
+class _SDChunkFormatter:
+    """Picklable callable that formats a chunk of a DataFrame as SD text in
+       a worker process, see dataframe_to_sd_file.
+    """
+
+    def __init__(self, toolkit: str, smiles_column: str, id_column: str,
+                 fingerprint_sd_field_name: Optional[str], fingerprint_fields: List[str]) -> None:
+        self.toolkit = toolkit
+        self.smiles_column = smiles_column
+        self.id_column = id_column
+        self.fingerprint_sd_field_name = fingerprint_sd_field_name
+        self.fingerprint_fields = fingerprint_fields
+
+    def __call__(self, chunk: DataFrame) -> bytes:
+        columns = list(chunk)
+        tags: List[str] = []
+        values: List[numpy.ndarray] = []
+        for kee in columns:
+            if kee == self.smiles_column:
+                continue
+            if self.fingerprint_fields and kee == self.fingerprint_fields[0]:
+                bits = chunk.iloc[:, columns.index(self.fingerprint_fields[0]):
+                                  columns.index(self.fingerprint_fields[-1]) + 1].to_numpy()
+                tags.append(typing.cast(str, self.fingerprint_sd_field_name))
+                values.append(numpy.array([fp.decode() for fp in bit_vector.to_base64_list(bits)], dtype=object))
+            if kee in self.fingerprint_fields:
+                continue
+            column = chunk[kee]
+            tags.append(kee)
+            values.append(numpy.where(column.isna().to_numpy(), "", column.astype(str).to_numpy()))
+
+        with cdd_toolkit(self.toolkit):
+            io_module = _import_iomodule(self.toolkit)
+            records = []
+            for i, (smiles, title) in enumerate(zip(chunk[self.smiles_column].tolist(),
+                                                    chunk[self.id_column].tolist())):
+                the_mol = from_smiles(smiles)
+                the_mol.title = title
+                for tag, tag_values in zip(tags, values):
+                    the_mol[tag] = tag_values[i]
+                records.append(io_module.mol_to_sd_record(the_mol))
+        return "".join(records).encode("UTF-8")
+
+
+def _dataframe_to_sd_file_parallel(dataframe: DataFrame, smiles_column: str, id_column: str, file_path: str,
+                                   fingerprint_sd_field_name: Optional[str],
+                                   fingerprint_column_prefix: Optional[str],
+                                   workers: int, chunk_size: int) -> None:
+    if not file_path.lower().endswith((".sdf", ".sdf.gz", ".sdf.zst")):
+        raise ValueError(f"Writing with workers requires an .sdf, .sdf.gz or .sdf.zst file: {file_path}")
+    fingerprint_fields = []
+    if fingerprint_column_prefix is not None:
+        fingerprint_fields = [kee for kee in dataframe if fingerprint_column_prefix in kee]
+    formatter = _SDChunkFormatter(get_toolkit(), smiles_column, id_column,
+                                  fingerprint_sd_field_name, fingerprint_fields)
+    chunks = (dataframe.iloc[start:start + chunk_size] for start in range(0, len(dataframe), chunk_size))
+
+    method = compression_method(file_path)
+    # pylint: disable=R1732
+    out: typing.BinaryIO = io.open(file_path, "wb")
+    if method is not None:
+        out = typing.cast(typing.BinaryIO, BlockCompressWriter(out, method))
+    with out, ProcessPoolExecutor(max_workers=workers) as executor:
+        for text in ordered_map(executor, formatter, chunks, 2 * workers):
+            out.write(text)
+
+
 # pylint: disable=R0912,R0913,R0914
 def dataframe_from_sd_file(file_path: str,
-                           smiles_column: str,
-                           smiles_index: int,
+                           smiles_column: Optional[str],
+                           smiles_index: Optional[int],
                            id_column: Optional[str] = None,
                            id_field_name: Optional[str] = None,
                            id_index: Optional[int] = None,
                            fingerprint_sd_field_name: Optional[str] = None,
                            fingerprint_bit_data_type: Optional[type] = None,
                            fingerprint_column_prefix: Optional[str] = None,
-                           column_dtypes: Optional[Dict[str, str]] = None) -> DataFrame:
+                           column_dtypes: Optional[Dict[str, str]] = None,
+                           columns: Optional[List[str]] = None,
+                           where: Union[None, str, typing.Callable[[typing.Mapping[str, typing.Any]], bool]] = None,
+                           schema: Optional[Dict[str, str]] = None,
+                           sample_size: int = 1000,
+                           workers: Optional[int] = None) -> DataFrame:
     """Read compounds and associated descriptor data from an SD file into
        a pandas DataFrame.
 
+       If ``workers`` is given an uncompressed SD file is split at record
+       boundaries into shards which are read in ``workers`` processes; the
+       column values of each shard are sent back as numpy arrays and
+       concatenated in file order, giving the same frame as reading on the
+       calling process.
+
        Parameters
        ----------
        file_path
            path to input sd file
        smiles_column
-           name of column in which to store SMILES representation of molecule
+           name of column in which to store SMILES representation of molecule;
+           if None no SMILES are generated and SD files are read as
+           SDRecords without building toolkit molecules
        smiles_index
            index at which to insert SMILES in column list
        id_column
@@ -283,56 +1322,440 @@ def dataframe_from_sd_file(file_path: str,
         column_dtypes
            mapping of column names to explicit types, this is currently
            implemented only for numeric types
+       columns
+           SD tags to read, all tags of the first record if None; other
+           tags are not converted
+       where
+           only molecules for which this is true are read; either a
+           callable or a Python expression like ``"pIC50 > 6"`` evaluated
+           with a read-only mapping of the SD tags (converted to float where
+           possible) of each molecule. Empty and missing tags are NaN, so
+           comparisons with them are False and the molecule is skipped. It
+           is applied while reading, before SMILES are generated for the
+           molecule.
+       schema
+           mapping of column names to dtypes (e.g. "Int64", "Float64",
+           "string") skipping dtype inference for these columns; with
+           numeric dtypes empty values are missing and other text raises
+           ValueError, "object" converts the column as a column mixing
+           numbers and text. ``frame.dtypes.astype(str).to_dict()`` of an
+           earlier load can be passed to skip inference on repeated loads;
+           mixed columns then keep the text of the file unless set to
+           "object".
+       sample_size
+           number of values from which the dtype of an SD tag column is
+           inferred: numeric if all are numbers, string if none is and str
+           (numbers converted to str of their float value) otherwise. A
+           numeric column with text values after the sampled ones is read as
+           a mixed column with a warning.
+       workers
+           number of processes reading shards of the file, None to read
+           on the calling process; ``where`` must then be a string or a
+           picklable callable
 
        Returns
        -------
            Molecules and descriptor data
     """
 
-    data_dict_list = []
+    if workers:
+        reader = _SDShardReader(get_toolkit(), file_path, smiles_column, smiles_index, id_column, id_field_name,
+                                id_index, fingerprint_sd_field_name, fingerprint_bit_data_type, columns, where,
+                                4 * workers)
+        data = _columns_frame(reader.read(workers), fingerprint_sd_field_name, fingerprint_column_prefix)
+    else:
+        rows = list(_sd_file_rows(file_path, smiles_column, smiles_index, id_column, id_field_name, id_index,
+                                  fingerprint_sd_field_name, columns, where))
+        data = _rows_frame(rows, fingerprint_sd_field_name, fingerprint_bit_data_type, fingerprint_column_prefix)
+    schema = _infer_schema(data, schema, [c for c in (smiles_column, id_column) if c is not None], sample_size)
+    return _convert_frame_dtypes(data, column_dtypes, schema)
+
+
+def iter_dataframes_from_sd_file(file_path: str,
+                                 smiles_column: Optional[str],
+                                 smiles_index: Optional[int],
+                                 id_column: Optional[str] = None,
+                                 id_field_name: Optional[str] = None,
+                                 id_index: Optional[int] = None,
+                                 fingerprint_sd_field_name: Optional[str] = None,
+                                 fingerprint_bit_data_type: Optional[type] = None,
+                                 fingerprint_column_prefix: Optional[str] = None,
+                                 column_dtypes: Optional[Dict[str, str]] = None,
+                                 columns: Optional[List[str]] = None,
+                                 where: Union[None, str, typing.Callable[[typing.Mapping[str, typing.Any]], bool]] = None,
+                                 schema: Optional[Dict[str, str]] = None,
+                                 sample_size: int = 1000,
+                                 chunksize: int = 10000) -> typing.Iterator[DataFrame]:
+    """Read compounds and associated descriptor data from an SD file into
+       pandas DataFrames of at most ``chunksize`` rows.
+
+       Columns are determined as in dataframe_from_sd_file. The dtypes of
+       the columns are inferred from the first chunk and later chunks are
+       converted to them so that pandas.concat of all chunks gives the same
+       frame as dataframe_from_sd_file as long as the first chunk is
+       representative. A ValueError is raised if a later chunk has values
+       that do not fit the inferred dtype, e.g. text or fractional values
+       in an integer column; use ``schema`` to fix the dtype of such
+       columns.
+
+       Parameters
+       ----------
+       file_path, smiles_column, smiles_index, id_column, id_field_name, id_index,
+       fingerprint_sd_field_name, fingerprint_bit_data_type, fingerprint_column_prefix, column_dtypes,
+       columns, where, schema, sample_size
+           see dataframe_from_sd_file
+       chunksize
+           number of molecules per DataFrame
+
+       Returns
+       -------
+           iterator over DataFrames, the row index continues across chunks
+    """
+    rows = _sd_file_rows(file_path, smiles_column, smiles_index, id_column, id_field_name, id_index,
+                         fingerprint_sd_field_name, columns, where)
+    text_columns = [c for c in (smiles_column, id_column) if c is not None]
+    try:
+        chunk_schema = None
+        start = 0
+        while chunk := list(itertools.islice(rows, chunksize)):
+            data = _rows_frame(chunk, fingerprint_sd_field_name, fingerprint_bit_data_type,
+                               fingerprint_column_prefix)
+            if chunk_schema is None:
+                schema = _infer_schema(data, schema, text_columns, sample_size)
+                data = _convert_frame_dtypes(data, column_dtypes, schema)
+                # later chunks get the dtypes of the first one
+                chunk_schema = {column: "object" if schema.get(column) == "object" else str(dtype)
+                                for column, dtype in data.dtypes.items()}
+            else:
+                data = _convert_frame_dtypes(data[list(chunk_schema)], None, chunk_schema)
+            data.index = pandas.RangeIndex(start, start + len(data))
+            start += len(data)
+            yield data
+    finally:
+        rows.close()
+
+
+def _sd_file_rows(file_path: str,
+                  smiles_column: Optional[str],
+                  smiles_index: Optional[int],
+                  id_column: Optional[str],
+                  id_field_name: Optional[str],
+                  id_index: Optional[int],
+                  fingerprint_sd_field_name: Optional[str],
+                  columns: Optional[List[str]] = None,
+                  where: Union[None, str, typing.Callable[[typing.Mapping[str, typing.Any]], bool]] = None,
+                  tags: Optional[List[str]] = None,
+                  shard: Optional[int] = None,
+                  num_shards: Optional[int] = None
+                  ) -> typing.Generator[Dict[str, typing.Any], None, None]:
+    """Yields one dict per molecule with the columns of dataframe_from_sd_file;
+       the columns are taken from ``tags``, by default the tags of the first
+       molecule. Tag values are returned as text and fingerprints base64
+       encoded, see _rows_frame and _convert_frame_dtypes.
+    """
     first = True
+    if isinstance(where, str):
+        code = compile(where, "<where>", "eval")
+
+        def where(tags: typing.Mapping[str, typing.Any]) -> bool:  # pylint: disable=E0102
+            return eval(code, {}, tags) # pylint: disable=W0123
 
-    with get_mol_input_stream(file_path) as reader:
+    with _sd_file_reader(file_path, smiles_column, shard, num_shards) as reader:
         for mol in reader:
-            if fingerprint_sd_field_name is not None:
-                fingerprint_bits = bit_vector.from_base64(mol[fingerprint_sd_field_name].encode(),
-                                                          typing.cast(type, fingerprint_bit_data_type))
             if first:
-                fields = list(mol.keys())
-                fields[smiles_index:smiles_index] = [smiles_column]
+                fields = list(mol.keys()) if tags is None else list(tags)
+                if columns is not None:
+                    wanted = set(columns)
+                    if fingerprint_sd_field_name is not None:
+                        wanted.add(fingerprint_sd_field_name)
+                    fields = [kee for kee in fields if kee in wanted]
+                    fields += [kee for kee in columns if kee not in fields]
+                if smiles_column is not None:
+                    fields[smiles_index:smiles_index] = [smiles_column]
                 if id_column is not None:
                     fields[id_index:id_index] = [id_column]
-                if fingerprint_sd_field_name is not None:
-                    fingerprint_index = fields.index(fingerprint_sd_field_name)
-                    fingerprint_columns = [f"{fingerprint_column_prefix}{bit:04d}"
-                                           for bit in range(fingerprint_bits.size)]
-                    fields[fingerprint_index:fingerprint_index+1] = fingerprint_columns
                 first = False
-            data_dict = {}
-            for kee in fields:
-                value = mol.get(kee, "")
-                try:
-                    value = float(value)
-                except ValueError:
-                    pass
-                data_dict[kee] = value
-            data_dict[smiles_column] = mol.canonical_smiles
+            if where is not None and not where(_TagValues(mol)):
+                continue
+            data_dict = {kee: mol.get(kee, "") for kee in fields}
+            if smiles_column is not None:
+                data_dict[smiles_column] = mol.canonical_smiles
             if id_column is not None:
                 if id_field_name is None:
                     data_dict[id_column] = mol.title
                 else:
                     data_dict[id_column] = mol.get(id_field_name)
             if fingerprint_sd_field_name is not None:
-                for bit in range(fingerprint_bits.size):
-                    data_dict[f"{fingerprint_column_prefix}{bit:04d}"] = fingerprint_bits[bit]
-            data_dict_list.append(data_dict)
-    data = DataFrame(data_dict_list).convert_dtypes()
+                data_dict[fingerprint_sd_field_name] = mol[fingerprint_sd_field_name]
+            yield data_dict
+
+
+def _sd_file_reader(file_path: str, smiles_column: Optional[str],
+                    shard: Optional[int] = None, num_shards: Optional[int] = None) -> BaseMolInputStream:
+    """Opens the input stream read by _sd_file_rows; without SMILES, SD
+       files are read as SDRecords.
+    """
+    if smiles_column is None and file_path.lower().endswith((".sdf", ".sdf.gz")):
+        return RawSDRecordInputStream(file_path, shard, num_shards)
+    if shard is not None:
+        return SDRecordMolInputStream(file_path, shard, num_shards)
+    return get_mol_input_stream(file_path)
+
+
+class _SDShardReader:
+    """Picklable callable that reads one shard of an SD file in a worker
+       process into the columns of _row_columns, see dataframe_from_sd_file.
+
+       Text columns are returned as one UTF-8 buffer with offsets and a
+       mask of missing values so that a shard is transferred as a few
+       buffers instead of one pickled object per value.
+    """
+
+    # pylint: disable=R0913
+    def __init__(self, toolkit: str, file_path: str,
+                 smiles_column: Optional[str], smiles_index: Optional[int],
+                 id_column: Optional[str], id_field_name: Optional[str], id_index: Optional[int],
+                 fingerprint_sd_field_name: Optional[str], fingerprint_bit_data_type: Optional[type],
+                 columns: Optional[List[str]],
+                 where: Union[None, str, typing.Callable[[typing.Mapping[str, typing.Any]], bool]],
+                 num_shards: int) -> None:
+        if not file_path.lower().endswith(".sdf"):
+            raise ValueError(f"Reading with workers requires an uncompressed SD file: {file_path}")
+        self.toolkit = toolkit
+        self.file_path = file_path
+        self.smiles_column = smiles_column
+        self.smiles_index = smiles_index
+        self.id_column = id_column
+        self.id_field_name = id_field_name
+        self.id_index = id_index
+        self.fingerprint_sd_field_name = fingerprint_sd_field_name
+        self.fingerprint_bit_data_type = fingerprint_bit_data_type
+        self.columns = columns
+        self.where = where
+        self.num_shards = num_shards
+        # all shards use the tags of the first molecule of the file
+        with _sd_file_reader(file_path, smiles_column) as first:
+            mol = next(iter(first), None)
+            self.tags = None if mol is None else list(mol.keys())
+
+    def __call__(self, shard: int) -> Dict[str, typing.Any]:
+        with cdd_toolkit(self.toolkit):
+            rows = list(_sd_file_rows(self.file_path, self.smiles_column, self.smiles_index, self.id_column,
+                                      self.id_field_name, self.id_index, self.fingerprint_sd_field_name,
+                                      self.columns, self.where, self.tags, shard, self.num_shards))
+            columns = _row_columns(rows, self.fingerprint_sd_field_name, self.fingerprint_bit_data_type)
+        return {name: values if name == self.fingerprint_sd_field_name else _pack_text(values)
+                for name, values in columns.items()}
+
+    def read(self, workers: int) -> Dict[str, typing.Any]:
+        """Reads all shards on ``workers`` processes and returns the
+           concatenated columns.
+        """
+        if self.tags is None:
+            return {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = [part for part in ordered_map(executor, self, range(self.num_shards), 2 * workers) if part]
+        if not parts:
+            return {}
+        res = {}
+        for name in parts[0]:
+            if name == self.fingerprint_sd_field_name:
+                res[name] = numpy.concatenate([part[name] for part in parts])
+            else:
+                res[name] = numpy.concatenate([_unpack_text(part[name]) for part in parts])
+        return res
+
+
+def _pack_text(values: typing.Sequence[Optional[str]]) -> typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Returns values as one UTF-8 buffer, the character offsets of the
+       values in it and the mask of None values.
+    """
+    missing = numpy.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    if missing.any():
+        values = ["" if value is None else value for value in values]
+    offsets = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.fromiter(map(len, values), dtype=numpy.int64, count=len(values)), out=offsets[1:])
+    text = "".join(values).encode("utf-8", "surrogatepass")
+    return numpy.frombuffer(text, dtype=numpy.uint8), offsets, missing
+
+
+def _unpack_text(packed: typing.Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]) -> numpy.ndarray:
+    """Inverse of _pack_text, returns an object array of str and None."""
+    buffer, offsets, missing = packed
+    text = buffer.tobytes().decode("utf-8", "surrogatepass")
+    res = numpy.empty(len(missing), dtype=object)
+    res[:] = [None if miss else text[start:end]
+              for start, end, miss in zip(offsets[:-1].tolist(), offsets[1:].tolist(), missing.tolist())]
+    return res
+
+
+def _sd_value(value: typing.Any) -> typing.Any:
+    """Convert SD tag value to float if possible, empty values to NaN."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return float("nan")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class _TagValues(typing.Mapping[str, typing.Any]):
+    """Read-only mapping of the SD tags of a molecule, values are converted
+       to float where possible on access. Empty and missing tags are NaN so
+       that comparisons with them are False; missing tags named like a
+       builtin raise KeyError so that eval() falls back to the builtin.
+    """
+
+    def __init__(self, mol: BaseMol) -> None:
+        self._mol = mol
+
+    def __getitem__(self, kee: str) -> typing.Any:
+        if kee not in self._mol:
+            if hasattr(builtins, kee):
+                raise KeyError(kee)
+            return float("nan")
+        return _sd_value(self._mol[kee])
+
+    def __contains__(self, kee: object) -> bool:
+        return kee in self._mol
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(list(self._mol.keys()))
+
+    def __len__(self) -> int:
+        return len(list(self._mol.keys()))
+
+
+def _rows_frame(data_dict_list: List[Dict[str, typing.Any]],
+                fingerprint_sd_field_name: Optional[str],
+                fingerprint_bit_data_type: Optional[type],
+                fingerprint_column_prefix: Optional[str]) -> DataFrame:
+    """Build a DataFrame from rows of _sd_file_rows replacing the fingerprint
+       column by one column per bit.
+    """
+    return _columns_frame(_row_columns(data_dict_list, fingerprint_sd_field_name, fingerprint_bit_data_type),
+                          fingerprint_sd_field_name, fingerprint_column_prefix)
+
+
+def _row_columns(data_dict_list: List[Dict[str, typing.Any]],
+                 fingerprint_sd_field_name: Optional[str],
+                 fingerprint_bit_data_type: Optional[type]) -> Dict[str, typing.Any]:
+    """Returns the values of each column of rows of _sd_file_rows, the
+       fingerprint column decoded into a 2-D array of bits.
+    """
+    names = list(data_dict_list[0]) if data_dict_list else []
+    columns: Dict[str, typing.Any] = dict(zip(names, zip(*(row.values() for row in data_dict_list))))
+    if fingerprint_sd_field_name is not None and data_dict_list:
+        columns[fingerprint_sd_field_name] = bit_vector.from_base64_list(
+            list(columns[fingerprint_sd_field_name]), typing.cast(type, fingerprint_bit_data_type))
+    return columns
+
+
+def _columns_frame(columns: Dict[str, typing.Any],
+                   fingerprint_sd_field_name: Optional[str],
+                   fingerprint_column_prefix: Optional[str]) -> DataFrame:
+    """Build a DataFrame from the output of _row_columns."""
+    data = DataFrame({name: pandas.Series(values, dtype=object)
+                      for name, values in columns.items() if name != fingerprint_sd_field_name})
+    if fingerprint_sd_field_name not in columns:
+        return data
+
+    bits = columns[fingerprint_sd_field_name]
+    bit_columns = [f"{fingerprint_column_prefix}{bit:04d}" for bit in range(bits.shape[1])]
+    fingerprint_index = list(columns).index(fingerprint_sd_field_name)
+    return pandas.concat([data.iloc[:, :fingerprint_index],
+                          DataFrame(bits, columns=bit_columns, index=data.index),
+                          data.iloc[:, fingerprint_index:]], axis=1)
+
+
+def _infer_schema(data: DataFrame, schema: Optional[Dict[str, str]], text_columns: typing.Collection[str],
+                  sample_size: int) -> Dict[str, str]:
+    """Returns schema completed with the dtypes of the SD tag columns of a
+       frame built by _rows_frame, chosen from their first ``sample_size``
+       values, see _infer_tag_dtype. ``text_columns`` and columns that are
+       not text (fingerprint bits) are left to convert_dtypes.
+    """
+    res = dict(schema) if schema is not None else {}
+    for column, dtype in data.dtypes.items():
+        if column not in res and column not in text_columns and dtype == object:
+            res[column] = _infer_tag_dtype(data[column].iloc[:sample_size])
+    return res
+
+
+def _convert_frame_dtypes(data: DataFrame, column_dtypes: Optional[Dict[str, str]],
+                          schema: Dict[str, str]) -> DataFrame:
+    """Convert the columns of a frame built by _rows_frame to the dtypes of
+       schema, see _to_dtype, the others with convert_dtypes. column_dtypes
+       are applied last.
+    """
+    typed = DataFrame({column: _to_dtype(data[column], dtype, column)
+                       for column, dtype in schema.items() if column in data},
+                      index=data.index)
+    rest = data.columns.difference(typed.columns, sort=False)
+    data = pandas.concat([data[rest].convert_dtypes(), typed], axis=1)[data.columns]
     if column_dtypes is not None:
         for column, dtype in column_dtypes.items():
             if column in data:
                 data[column] = pandas.to_numeric(data[column], errors="coerce").astype(dtype)
-    if mixed_dtypes := {c: dtype for c in data.columns if (dtype := pandas.api.types.infer_dtype(data[c])).startswith("mixed")}:
-        for column in mixed_dtypes:
-            data[column] = data[column].astype(str)
 
     return data
+
+
+def _number_mask(values: pandas.Series, numbers: pandas.Series) -> pandas.Series:
+    """True for values that float() accepts, given their pandas.to_numeric result."""
+    mask = numbers.notna()
+    missing = ~mask
+    if missing.any():
+        text = values[missing].astype(str).str.strip().str.lower()
+        mask[missing] = text.isin(("nan", "+nan", "-nan"))
+    return mask
+
+
+def _infer_tag_dtype(sample: pandas.Series) -> str:
+    """Returns "numeric" if all SD tag values of sample are numbers,
+       "string" if none is and "object" for a mix of both.
+    """
+    is_number = _number_mask(sample, pandas.to_numeric(sample, errors="coerce"))
+    if is_number.all():
+        return "numeric"
+    if not is_number.any():
+        return "string"
+    return "object"
+
+
+def _to_dtype(values: pandas.Series, dtype: str, column: str) -> pandas.Series:
+    """Convert a column of SD tag text to dtype.
+
+       "numeric" lets convert_dtypes choose between integer and float; if
+       values after the sampled ones are not numbers (e.g. qualified values
+       like ">10") the column is converted as "object" instead. "object"
+       converts numbers to the str of their float value and keeps other
+       values, as is done for columns mixing numbers and text. For numeric
+       dtypes empty values are missing and other text raises ValueError.
+    """
+    text_kind = dtype in ("numeric", "object")
+    if values.dtype == object and (text_kind or pandas.api.types.is_numeric_dtype(dtype)):
+        numbers = pandas.to_numeric(values, errors="coerce")
+        is_number = _number_mask(values, numbers)
+        if dtype == "numeric":
+            if is_number.all():
+                return numbers.convert_dtypes()
+            logging.warning("Column %s has values that are not numbers after the first ones, e.g. %r;"
+                            " reading it as text", column, values[~is_number].iloc[0])
+            dtype = "object"
+        if dtype == "object":
+            res = values.copy()
+            res[is_number] = numbers[is_number].astype(float).astype(str)
+            return res.astype(str)
+        text = ~is_number & values.notna() & (values.astype(str).str.strip() != "")
+        if text.any():
+            raise ValueError(f"Column {column} has values that are not numbers, e.g. {values[text].iloc[0]!r};"
+                             f" it can not be read as {dtype}, set a text dtype with schema")
+        values = numbers
+    elif text_kind:
+        return values.convert_dtypes()
+    try:
+        return values.astype(dtype)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"Values of column {column} do not fit dtype {dtype},"
+                         " set the dtype with schema") from exc
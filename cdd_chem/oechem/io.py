@@ -7,7 +7,10 @@ Created on Jul 1, 2018
 
 Module containing input/output operations using the OpenEye Toolkit.
 """
-from typing import Optional, Dict, Collection
+import io
+import logging
+import os
+from typing import Optional, Dict, Collection, Iterable, Iterator
 
 import numpy as np
 from openeye import oechem
@@ -15,12 +18,17 @@ from openeye import oechem
 from cdd_chem import BaseMol
 from cdd_chem.oechem.mol import Mol
 
-from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream
+from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream, SDRandomAccessMixin
 from cdd_chem.util.IterableAlgorithm import SimpleIterableAlgorithm, IterableAlgorithm
+from cdd_chem.util.block_compress import BlockCompressWriter, compression_method
 
 
-class MolInputStream(BaseMolInputStream):
-    """Provide an iterator for reading molecules using the OpenEye toolkit."""
+class MolInputStream(SDRandomAccessMixin, BaseMolInputStream):
+    """Provide an iterator for reading molecules using the OpenEye toolkit.
+
+       Uncompressed SD files also support num_records(), indexing, slicing
+       and seek(), see SDRandomAccessMixin.
+    """
 
     def __init__(self, file_path: str) -> None:
         super().__init__()
@@ -35,6 +43,10 @@ class MolInputStream(BaseMolInputStream):
         if self.next_mol is not None:
             return True
 
+        if self._seek_record is not None:
+            self.next_mol = self._next_seeked()
+            return self.next_mol is not None
+
         mol = oechem.OEGraphMol()
         if oechem.OEReadMolecule(self.ifs, mol):
             self.next_mol = Mol(mol)
@@ -50,6 +62,7 @@ class MolInputStream(BaseMolInputStream):
         return res
 
     def close(self):
+        self._close_index()
         if self.ifs is not None:
             self.ifs.close()
         self.ifs = None
@@ -58,18 +71,85 @@ class MolInputStream(BaseMolInputStream):
 class MolOutputStream(BaseMolOutputStream):
     """Molecule output stream for writing molecules to file using the OpenEye toolkit."""
 
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, compress_threads: Optional[int] = None,
+                 compress_level: Optional[int] = None) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            output file, any format known to OEChem; .zst compression is
+            supported for text formats (e.g. .sdf.zst, .smi.zst)
+        compress_threads
+            if given, compressed output is written as independent blocks
+            compressed on this many threads, see BlockCompressWriter
+        compress_level
+            compression level, requires block compression
+        """
         super().__init__(file_path)
-        self.ofs = oechem.oemolostream(file_path)
+        self.ofs = None
+        self._out: Optional[BlockCompressWriter] = None
+
+        method = compression_method(file_path)
+        if method is not None and (compress_threads or compress_level is not None or method == "zstd"):
+            # OEChem writes each molecule to bytes, compression is done by BlockCompressWriter
+            self._format = os.path.splitext(file_path[:file_path.rindex(".")])[1]
+            self._out = BlockCompressWriter(io.open(file_path, "wb"), # pylint: disable=R1732
+                                            method, compress_level, compress_threads or 1)
+        else:
+            self.ofs = oechem.oemolostream(file_path)
 
     def write_mol(self, mol):
         """Writes molecule to stream."""
         # pylint: disable=protected-access
-        oechem.OEWriteMolecule(self.ofs, mol._mol)
+        if self._out is not None:
+            self._out.write(oechem.OEWriteMolToBytes(self._format, mol._mol))
+        else:
+            oechem.OEWriteMolecule(self.ofs, mol._mol)
 
     def close(self):
         """Closes output stream."""
-        self.ofs.close()
+        if self._out is not None:
+            self._out.close()
+        else:
+            self.ofs.close()
+
+
+def mols_from_sd_records(records: Iterable[bytes]) -> Iterator[Mol]:
+    """Parse SD records (as produced by cdd_chem.util.sd_file.iter_sd_records)
+       into molecules.
+
+       Records that cannot be parsed are skipped by OEChem with a warning.
+    """
+    ifs = oechem.oemolistream()
+    ifs.SetFormat(oechem.OEFormat_SDF)
+    if not ifs.openstring(b"".join(records)):
+        logging.warning("Could not open SD records for reading")
+        return
+    mol = oechem.OEGraphMol()
+    while oechem.OEReadMolecule(ifs, mol):
+        yield Mol(mol)
+        mol = oechem.OEGraphMol()
+    ifs.close()
+
+
+def mol_to_sd_record(mol: Mol) -> str:
+    """Returns the SD record of the molecule as written by MolOutputStream."""
+    # pylint: disable=protected-access
+    return oechem.OEWriteMolToBytes(".sdf", mol._mol).decode("UTF-8")
+
+
+def mol_to_binary(mol: Mol) -> bytes:
+    """Serialize molecule including all SD data to the OEB format."""
+    # pylint: disable=protected-access
+    return oechem.OEWriteMolToBytes(".oeb", mol._mol)
+
+
+def mol_from_binary(data: bytes) -> Mol:
+    """Create molecule from the output of mol_to_binary."""
+    mol = oechem.OEGraphMol()
+    if not oechem.OEReadMolFromBytes(mol, ".oeb", data):
+        raise IOError("Could not read molecule from OEB bytes")
+    return Mol(mol)
 
 
 class MolNumpyFormatter(SimpleIterableAlgorithm[BaseMol,BaseMol]):
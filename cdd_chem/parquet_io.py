@@ -0,0 +1,258 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Molecule input and output streams for Parquet files.
+
+Each row holds the canonical SMILES, the title, optionally the molecule in
+the binary format of the toolkit that wrote it and one typed column per SD
+tag. The column types are inferred from the first row group. The tag
+columns can be read without parsing any molecule, e.g. with
+``pandas.read_parquet(file_path, columns=[...])``.
+
+Requires the optional ``pyarrow`` package.
+"""
+
+import logging
+import typing
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream, _import_iomodule
+from cdd_chem.mol import BaseMol, from_smiles
+from cdd_chem.toolkit import get_toolkit
+
+SMILES_COLUMN = "smiles"
+TITLE_COLUMN = "title"
+MOL_COLUMN = "mol"
+# prefix of tag columns whose name would collide with the columns above
+TAG_PREFIX = "tag:"
+
+_TOOLKIT_KEY = b"cdd_chem.toolkit"
+
+
+def _import_pyarrow():
+    try:
+        # pylint: disable=C0415
+        import pyarrow
+        import pyarrow.parquet
+    except ModuleNotFoundError as exc:
+        raise ModuleNotFoundError("Parquet files require the pyarrow package") from exc
+    return pyarrow
+
+
+def _tag_column(tag: str) -> str:
+    if tag in (SMILES_COLUMN, TITLE_COLUMN, MOL_COLUMN) or tag.startswith(TAG_PREFIX):
+        return TAG_PREFIX + tag
+    return tag
+
+
+def _column_tag(column: str) -> str:
+    return column[len(TAG_PREFIX):] if column.startswith(TAG_PREFIX) else column
+
+
+def _infer_type(values: List[Any], pa):
+    """Returns int64 or float64 if all values can be converted, string otherwise."""
+    present = [v for v in values if v is not None and v != ""]
+    for pa_type, convert in ((pa.int64(), int), (pa.float64(), float)):
+        try:
+            for value in present:
+                if isinstance(value, bool) or (convert is int and isinstance(value, float)):
+                    raise ValueError()
+                convert(value)
+            return pa_type
+        except (TypeError, ValueError):
+            pass
+    return pa.string()
+
+
+class ParquetMolOutputStream(BaseMolOutputStream):
+    """Writes molecules and their SD tags to a Parquet file.
+
+       Rows are buffered and written in row groups of ``row_group_size``.
+       The schema is inferred from the first row group: SD tags that first
+       appear later are dropped and values that cannot be converted to the
+       inferred column type are written as null, both with a warning.
+    """
+
+    def __init__(self, file_path: str, row_group_size: int = 10000, binary: bool = True,
+                 compression: str = "zstd") -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            .parquet file
+        row_group_size
+            number of molecules per row group
+        binary
+            store the toolkit binary molecule in column "mol" to allow
+            reading back the exact molecule instead of parsing the SMILES
+        compression
+            parquet compression codec
+        """
+        super().__init__(file_path)
+        self._pa = _import_pyarrow()
+        self._io_module = _import_iomodule(get_toolkit())
+        self._row_group_size = row_group_size
+        self._binary = binary
+        self._compression = compression
+        self._writer = None
+        self._schema = None
+        self._rows: List[Dict[str, Any]] = []
+        self._warned: typing.Set[str] = set()
+
+    def write_mol(self, mol: BaseMol):
+        """Writes molecule to stream."""
+        row = {_tag_column(key): value for key, value in mol.items()}
+        row[TITLE_COLUMN] = mol.title
+        row[SMILES_COLUMN] = mol.canonical_smiles
+        if self._binary:
+            row[MOL_COLUMN] = self._io_module.mol_to_binary(mol)
+        self._rows.append(row)
+        if len(self._rows) >= self._row_group_size:
+            self._write_row_group()
+
+    def _infer_schema(self):
+        pa = self._pa
+        fields = [pa.field(TITLE_COLUMN, pa.string()), pa.field(SMILES_COLUMN, pa.string())]
+        if self._binary:
+            fields.append(pa.field(MOL_COLUMN, pa.binary()))
+        tag_columns: Dict[str, None] = {}
+        for row in self._rows:
+            tag_columns.update(dict.fromkeys(row))
+        for name in tag_columns:
+            if name not in (TITLE_COLUMN, SMILES_COLUMN, MOL_COLUMN):
+                fields.append(pa.field(name, _infer_type([row.get(name) for row in self._rows], pa)))
+        metadata = {_TOOLKIT_KEY: get_toolkit().encode("UTF-8")}
+        return pa.schema(fields, metadata=metadata)
+
+    def _convert(self, name: str, values: List[Any], pa_type) -> List[Any]:
+        pa = self._pa
+        if pa_type == pa.string():
+            return [None if v is None else str(v) for v in values]
+        if pa_type == pa.binary():
+            return values
+        convert = int if pa_type == pa.int64() else float
+        res = []
+        for value in values:
+            if value is None or value == "":
+                res.append(None)
+                continue
+            try:
+                res.append(convert(value))
+            except (TypeError, ValueError):
+                if name not in self._warned:
+                    self._warned.add(name)
+                    logging.warning("%s: value %r of column %s is not %s, writing null",
+                                    self.file_path, value, name, pa_type)
+                res.append(None)
+        return res
+
+    def _write_row_group(self) -> None:
+        pa = self._pa
+        if self._schema is None:
+            self._schema = self._infer_schema()
+            self._writer = pa.parquet.ParquetWriter(self.file_path, self._schema,
+                                                    compression=self._compression)
+        names = set(self._schema.names)
+        for row in self._rows:
+            for name in row:
+                if name not in names and name not in self._warned:
+                    self._warned.add(name)
+                    logging.warning("%s: tag %s is not in the schema of the first row group, dropped",
+                                    self.file_path, name)
+        columns = [pa.array(self._convert(field.name, [row.get(field.name) for row in self._rows], field.type),
+                            type=field.type)
+                   for field in self._schema]
+        typing.cast(Any, self._writer).write_table(pa.Table.from_arrays(columns, schema=self._schema))
+        self._rows.clear()
+
+    def close(self):
+        """Writes the buffered rows and closes the file."""
+        if self._rows or self._schema is None:
+            self._write_row_group()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ParquetMolInputStream(BaseMolInputStream):
+    """Reads molecules from a Parquet file written by ParquetMolOutputStream.
+
+       Molecules are restored from the binary column if it is read and was
+       written with the current toolkit, otherwise they are parsed from the
+       SMILES; the title and the tag columns that are read are set on the
+       molecule.
+    """
+
+    def __init__(self, file_path: str, columns: Optional[List[str]] = None,
+                 batch_size: int = 10000) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            .parquet file
+        columns
+            columns to read, e.g. ["smiles", "logP"], all columns if None.
+            The smiles column is always read if the mol column is not.
+        batch_size
+            number of rows read at a time
+        """
+        super().__init__()
+        pa = _import_pyarrow()
+        self._file = pa.parquet.ParquetFile(file_path)
+        schema = self._file.schema_arrow
+        metadata = schema.metadata or {}
+
+        columns = list(schema.names if columns is None else columns)
+        missing = [c for c in columns if c not in schema.names]
+        if missing:
+            raise KeyError(f"{file_path} has no columns {missing}")
+        if MOL_COLUMN in columns and metadata.get(_TOOLKIT_KEY) != get_toolkit().encode("UTF-8"):
+            columns.remove(MOL_COLUMN)
+        if MOL_COLUMN not in columns and SMILES_COLUMN not in columns:
+            columns.append(SMILES_COLUMN)
+
+        self._io_module = _import_iomodule(get_toolkit())
+        self._batches = self._file.iter_batches(batch_size=batch_size, columns=columns)
+        self._mols: typing.Deque[BaseMol] = deque()
+        self.next_mol: Optional[BaseMol] = None
+
+    def _read_batch(self, batch) -> List[BaseMol]:
+        data = batch.to_pydict()
+        if MOL_COLUMN in data:
+            mols = [self._io_module.mol_from_binary(blob) for blob in data.pop(MOL_COLUMN)]
+            data.pop(SMILES_COLUMN, None)
+        else:
+            mols = [from_smiles(smi) for smi in data.pop(SMILES_COLUMN)]
+        titles = data.pop(TITLE_COLUMN, None)
+        if titles is not None:
+            for mol, title in zip(mols, titles):
+                mol.title = title or ""
+        for column, values in data.items():
+            tag = _column_tag(column)
+            for mol, value in zip(mols, values):
+                if value is not None:
+                    mol[tag] = value if isinstance(value, str) else str(value)
+        return mols
+
+    def has_next(self) -> bool:
+        if self.next_mol is not None:
+            return True
+        while not self._mols:
+            batch = next(self._batches, None)
+            if batch is None:
+                return False
+            self._mols.extend(self._read_batch(batch))
+        self.next_mol = self._mols.popleft()
+        return True
+
+    def __next__(self) -> BaseMol:
+        if not self.has_next():
+            raise StopIteration()
+        res = typing.cast(BaseMol, self.next_mol)
+        self.next_mol = None
+        return res
+
+    def close(self) -> None:
+        self._mols.clear()
+        self._file.close()
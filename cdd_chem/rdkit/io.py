@@ -8,30 +8,117 @@ Created on Jul 1, 2018
 
 import io
 import gzip
+import itertools
+import logging
+import mmap
 import sys
 import re
 import os
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, List, Optional
 
 import rdkit
 
 from cdd_chem.rdkit.mol import Mol
-from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream
+from cdd_chem.io import BaseMolInputStream, BaseMolOutputStream, SDRandomAccessMixin
+from cdd_chem.util.block_compress import BlockCompressWriter, compression_method, zstd_reader
+from cdd_chem.util.parallel import ordered_map
+from cdd_chem.util.sd_file import iter_sd_record_batches
 
 
-class MolInputStream(BaseMolInputStream):
+class SmilesMolSupplier:
+    """Iterator over the RDKit molecules of a SMILES file stream.
+
+       Each line holds a SMILES followed by an optional name separated by
+       whitespace; the name is stored as _Name (i.e. title) as OEChem does.
+       Lines are read and parsed in batches. If threads is given the batches
+       are parsed on a thread pool, which speeds up parsing as far as the
+       RDKit build releases the GIL. Lines that cannot be parsed are
+       skipped with a warning.
+    """
+
+    def __init__(self, in_s, batch_size: int = 1000, threads: Optional[int] = None,
+                 sanitize: bool = True, title_line: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        in_s
+            binary stream with SMILES lines
+        batch_size
+            number of lines parsed at a time
+        threads
+            number of parser threads, None to parse on the calling thread
+        sanitize
+            sanitize molecules, perceiving aromaticity as OEChem does
+        title_line
+            skip first line of the file
+        """
+        self._sanitize = sanitize
+        self._executor = None
+        if title_line:
+            in_s.readline()
+        batches = iter(lambda: list(itertools.islice(in_s, batch_size)), [])
+        if threads:
+            self._executor = ThreadPoolExecutor(max_workers=threads)
+            self._results = ordered_map(self._executor, self._parse_lines, batches, 2 * threads)
+        else:
+            self._results = map(self._parse_lines, batches)
+        self._mols = itertools.chain.from_iterable(self._results)
+
+    def _parse_lines(self, lines: List[bytes]) -> List[Any]:
+        mols = []
+        for line in lines:
+            fields = line.decode("UTF-8", errors="replace").split(None, 1)
+            if not fields:
+                continue
+            mol = rdkit.Chem.MolFromSmiles(fields[0], sanitize=self._sanitize)
+            if mol is None:
+                logging.warning("Could not parse SMILES %s, skipping", fields[0])
+                continue
+            mol.SetProp("_Name", fields[1].strip() if len(fields) > 1 else "")
+            mols.append(mol)
+        return mols
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._mols)
+
+    def close(self) -> None:
+        """Stops the parser threads."""
+        if self._executor is not None:
+            self._results.close() # type: ignore
+            self._executor.shutdown()
+            self._executor = None
+
+
+class MolInputStream(SDRandomAccessMixin, BaseMolInputStream):
     """Provide an iterator for reading molecules using RDKit
 
+       Supports .sdf and .smi files, optionally gzipped. Keyword arguments
+       are passed to ForwardSDMolSupplier or SmilesMolSupplier.
+
+       Uncompressed SD files also support num_records(), indexing, slicing
+       and seek(), see SDRandomAccessMixin. With ``memory_map=True`` they are
+       mapped into memory and records are sliced out of the mapping and
+       parsed in batches of ``batch_size`` instead of being read through
+       file buffers; the record text is decoded only when handed to RDKit.
+
        @TODO specify format?
     """
-    sdf_re = re.compile(".sdf(.gz)?$", re.I)
-    smi_re = re.compile(".smi(.gz)?$", re.I)
+    sdf_re = re.compile(".sdf(.gz|.zst)?$", re.I)
+    smi_re = re.compile(".smi(.gz|.zst)?$", re.I)
 
-    def __init__(self, file_path, **kwargs):
+    def __init__(self, file_path, memory_map: bool = False, **kwargs):
         super().__init__()
 
         self.file_path = file_path
         self.next_mol = None
+        self._memory_map = memory_map
+        self._mmap: Optional[mmap.mmap] = None
+        if memory_map and (not file_path.lower().endswith(".sdf") or MolInputStream.sdf_re.match(file_path)):
+            raise ValueError(f"memory_map requires an uncompressed SD file: {self.file_path}")
 
         if MolInputStream.sdf_re.match(file_path) is not None or \
            MolInputStream.smi_re.match(file_path) is not None:
@@ -44,6 +131,9 @@ class MolInputStream(BaseMolInputStream):
         if self.file_path.endswith("gz"):
             in_s = gzip.open(in_s, mode="rb")
             self._in2 = in_s
+        elif self.file_path.endswith(".zst"):
+            in_s = zstd_reader(in_s)
+            self._in2 = in_s
         else:
             self._in2 = None
 
@@ -55,10 +145,18 @@ class MolInputStream(BaseMolInputStream):
             if "sanitize" not in kwargs:
                 kwargs['sanitize'] = False   # this is more oelike
 
-            self._in3 = rdkit.Chem.ForwardSDMolSupplier(in_s, **kwargs)
+            if memory_map:
+                self._batch_size = kwargs.pop("batch_size", 64)
+                self._parse_kwargs = kwargs
+                if os.fstat(self._in1.fileno()).st_size > 0:
+                    self._mmap = mmap.mmap(self._in1.fileno(), 0, access=mmap.ACCESS_READ)
+                self._in3 = self._iter_mapped_mols(0)
+            else:
+                self._parse_kwargs = kwargs
+                self._in3 = rdkit.Chem.ForwardSDMolSupplier(in_s, **kwargs)
 
-        # elif MolInputStream.smiRE.search(self.file_path) is not None:
-        #   self._in3 = Chem.SmilesMolSupplier(self._in2)
+        elif MolInputStream.smi_re.search(self.file_path) is not None:
+            self._in3 = SmilesMolSupplier(in_s, **kwargs)
         else:
             raise Exception("Unknown file format: " + self.file_path)
 
@@ -80,8 +178,35 @@ class MolInputStream(BaseMolInputStream):
 
         return Mol(next(self._in3))
 
+    def _iter_mapped_mols(self, start: int) -> Iterator[Any]:
+        """Yields the RDKit molecules of the mapped file from offset start on."""
+        if self._mmap is None:
+            return
+        for batch in iter_sd_record_batches(self._mmap, start, batch_size=self._batch_size):
+            suppl = rdkit.Chem.SDMolSupplier()
+            suppl.SetData(str(batch, "UTF-8", "replace"), **self._parse_kwargs)
+            batch.release()
+            yield from suppl
+
+    def _seek_to(self, i):
+        """Reposition the file and restart the supplier at record i."""
+        offset = int(self._sd_index().offsets[i])
+        if self._memory_map:
+            self._in3.close()
+            self._in3 = self._iter_mapped_mols(offset)
+            return
+        self._in1.seek(offset)
+        self._in3 = rdkit.Chem.ForwardSDMolSupplier(self._in1, **self._parse_kwargs)
+
     def close(self):
-        # self._in3.close()
+        self._close_index()
+        if self._memory_map:
+            self._in3.close()
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+        if isinstance(self._in3, SmilesMolSupplier):
+            self._in3.close()
         if self._in2 is not None:
             self._in2.close()
         if self._in1 is not None:
@@ -91,12 +216,27 @@ class MolInputStream(BaseMolInputStream):
 class MolOutputStream(BaseMolOutputStream):
     """Molecule output stream for writing molecules to file using the RDKit toolkit."""
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, compress_threads: Optional[int] = None,
+                 compress_level: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        file_path
+            .sdf or .smi file, optionally compressed (.gz, .zst)
+        compress_threads
+            if given, compressed output is written as independent blocks
+            compressed on this many threads, see BlockCompressWriter;
+            .zst output is always block compressed
+        compress_level
+            compression level, defaults to 9 for gzip without threads and to
+            the BlockCompressWriter defaults otherwise
+        """
         super().__init__(file_path)
 
         out: Any
 
-        if self.file_path.endswith("gz"):
+        method = compression_method(self.file_path)
+        if method is not None:
             if self.file_path.startswith(".sdf") or self.file_path.startswith(".smi"):
                 out = os.fdopen(sys.stdout.fileno(), "wb", closefd=False)
                 self._out1 = None
@@ -104,7 +244,13 @@ class MolOutputStream(BaseMolOutputStream):
                 out = io.open(self.file_path, "wb") # pylint: disable=R1732
                 self._out1 = out
 
-            out = gzip.open(out, encoding='UTF-8', mode='wt')
+            if method == "gzip" and not compress_threads:
+                out = gzip.open(out, encoding='UTF-8', mode='wt',
+                                compresslevel=9 if compress_level is None else compress_level)
+            else:
+                out = io.TextIOWrapper(BlockCompressWriter(out, method, compress_level, compress_threads or 1,
+                                                           close_raw=False),
+                                       encoding='UTF-8')
             self._out2 = out
         else:
             if self.file_path.startswith(".sdf") or self.file_path.startswith(".smi"):
@@ -135,3 +281,55 @@ class MolOutputStream(BaseMolOutputStream):
             self._out2.close()
         if self._out1 is not None:
             self._out1.close()
+
+
+def mols_from_sd_records(records: Iterable[bytes], **kwargs) -> Iterator[Mol]:
+    """Parse SD records (as produced by cdd_chem.util.sd_file.iter_sd_records)
+       into molecules.
+
+       Records that cannot be parsed are skipped with a warning.
+
+       Parameters
+       ----------
+       records
+           SD records including their terminating $$$$ line
+       kwargs
+           passed to rdkit.Chem.SDMolSupplier.SetData; removeHs and
+           sanitize default to False as in MolInputStream
+    """
+    kwargs.setdefault('removeHs', False)
+    kwargs.setdefault('sanitize', False)
+
+    suppl = rdkit.Chem.SDMolSupplier()
+    suppl.SetData(b"".join(records).decode("UTF-8", errors="replace"), **kwargs)
+    for i, mol in enumerate(suppl):
+        if mol is None:
+            logging.warning("Could not parse SD record %d of batch, skipping", i)
+            continue
+        yield Mol(mol)
+
+
+def mol_to_sd_record(mol: Mol) -> str:
+    """Returns the SD record of the molecule as written by MolOutputStream."""
+    out = io.StringIO()
+    writer = rdkit.Chem.SDWriter(out)
+    # pylint: disable=protected-access
+    writer.write(mol._mol)
+    writer.flush()
+    return out.getvalue()
+
+
+def mol_to_binary(mol: Mol) -> bytes:
+    """Serialize molecule including all properties to the RDKit binary format.
+
+       Coordinates are stored in double precision so that the molecule
+       round trips without loss.
+    """
+    # pylint: disable=protected-access
+    return mol._mol.ToBinary(rdkit.Chem.PropertyPickleOptions.AllProps
+                             | rdkit.Chem.PropertyPickleOptions.CoordsAsDouble)
+
+
+def mol_from_binary(data: bytes) -> Mol:
+    """Create molecule from the output of mol_to_binary."""
+    return Mol(rdkit.Chem.Mol(data))
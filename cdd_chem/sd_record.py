@@ -0,0 +1,213 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Toolkit independent representation of an SD file record.
+
+An SDRecord gives access to the title and the SD tags of a record without
+building a toolkit molecule. The toolkit molecule is only created when a
+structural property is accessed.
+"""
+
+import re
+import typing
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from cdd_chem.atom import BaseAtom
+from cdd_chem.mol import BaseMol
+
+_TAG_NAME_RE = re.compile("<([^>]*)>")
+
+
+class SDRecord(BaseMol):
+    """SD record holding the connection table text, the SD tags and the
+       title of a molecule.
+
+       Tag access and writing the record back as text do not need a toolkit.
+       The first access to a structural property parses the record with the
+       current toolkit; from then on the toolkit molecule (see ``mol``) holds
+       the structure and the tags.
+    """
+
+    # pylint: disable=W0231
+    def __init__(self, molblock: str, tags: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Parameters
+        ----------
+        molblock
+            MDL connection table including the title line and M  END
+        tags
+            SD tag names and values
+        """
+        self.objects = {}
+        self.molblock = molblock
+        self.tags: Dict[str, Any] = tags if tags is not None else {}
+        self._title = molblock[:molblock.find("\n")].rstrip("\r") if "\n" in molblock else molblock
+        self._native: Optional[BaseMol] = None
+
+    @property
+    def mol(self) -> BaseMol:
+        """Returns the toolkit molecule, parsing the record on first access."""
+        if self._native is None:
+            # pylint: disable=C0415
+            from cdd_chem.io import mol_from_sd_record   # avoid circular import
+            self._native = mol_from_sd_record(self.sdf_record.encode("UTF-8"))
+        return self._native
+
+    @property
+    def is_parsed(self) -> bool:
+        """True if the toolkit molecule has been built."""
+        return self._native is not None
+
+    @property
+    def _mol(self):
+        """Native toolkit molecule as used by the output streams."""
+        return self.mol._mol # pylint: disable=W0212
+
+    def make_read_write(self):
+        self.mol.make_read_write()
+
+    def make_read_only(self):
+        self.mol.make_read_only()
+
+    def addH(self, addCoords=False): # noqa: N802
+        self.mol.addH(addCoords)
+
+    def removeH(self): # noqa: N802
+        self.mol.removeH()
+
+    @property
+    def num_atoms(self) -> int:
+        return self.mol.num_atoms
+
+    @property
+    def num_bonds(self) -> int:
+        return self.mol.num_bonds
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        return self.mol.coordinates
+
+    @coordinates.setter
+    def coordinates(self, positions: np.ndarray) -> None:
+        self.mol.coordinates = positions
+
+    @property
+    def atoms(self) -> typing.List[BaseAtom]:
+        return self.mol.atoms
+
+    @property
+    def atom_symbols(self) -> typing.List[str]:
+        return self.mol.atom_symbols
+
+    @property
+    def atom_types(self) -> typing.List[int]:
+        return self.mol.atom_types
+
+    def delete_atom(self, at: BaseAtom):
+        self.mol.delete_atom(at)
+
+    @property
+    def canonical_smiles(self) -> str:
+        return self.mol.canonical_smiles
+
+    @property
+    def canonical_non_isomeric_smiles(self) -> str:
+        return self.mol.canonical_non_isomeric_smiles
+
+    @property
+    def title(self) -> str:
+        if self._native is not None:
+            return self._native.title
+        return self._title
+
+    @title.setter
+    def title(self, val) -> None:
+        if self._native is not None:
+            self._native.title = val
+        self._title = val
+
+    def __contains__(self, key) -> bool:
+        if self._native is not None:
+            return key in self._native
+        return key in self.tags
+
+    def __getitem__(self, key: str) -> Any:
+        if self._native is not None:
+            return self._native[key]
+        return self.tags[key]
+
+    def __setitem__(self, key: str, value: Any):
+        if self._native is not None:
+            self._native[key] = value
+        self.tags[key] = value
+
+    def keys(self) -> typing.Iterator[str]:
+        if self._native is not None:
+            return self._native.keys()
+        return iter(self.tags.keys())
+
+    def items(self) -> typing.Iterator[typing.Tuple[str, str]]:
+        if self._native is not None:
+            return self._native.items()
+        return iter(self.tags.items())
+
+    def __delitem__(self, key: str):
+        if self._native is not None:
+            del self._native[key]
+        self.tags.pop(key, None)
+
+    @property
+    def mol_file(self) -> str:
+        if self._native is not None:
+            return self._native.mol_file
+        nl_pos = self.molblock.find("\n")
+        return self._title + (self.molblock[nl_pos:] if nl_pos >= 0 else "\n")
+
+
+def parse_sd_record(record: bytes) -> SDRecord:
+    """Split the text of one SD record into connection table and tags.
+
+       Parameters
+       ----------
+       record
+           one record as produced by cdd_chem.util.sd_file.iter_sd_records
+
+       Returns
+       -------
+           record; multi line tag values are joined with newlines
+    """
+    text = bytes(record).decode("UTF-8", errors="replace")
+    end = text.find("\nM  END")
+    if end < 0:
+        # no properties block; the connection table ends before the first tag
+        end = text.find("\n>")
+        block_end = len(text) if end < 0 else end + 1
+    else:
+        block_end = text.find("\n", end + 1) + 1 or len(text)
+
+    tags: Dict[str, Any] = {}
+    name = None
+    values: typing.List[str] = []
+    for line in text[block_end:].split("\n"):
+        line = line.rstrip("\r")
+        if name is None:
+            if line.startswith(">"):
+                match = _TAG_NAME_RE.search(line)
+                if match is not None:
+                    name = match.group(1)
+                    values = []
+            elif line.startswith("$$$$"):
+                break
+        elif line.strip() == "" or line == "$$$$":
+            tags[name] = "\n".join(values)
+            name = None
+            if line == "$$$$":
+                break
+        else:
+            values.append(line)
+    if name is not None:
+        tags[name] = "\n".join(values)
+
+    return SDRecord(text[:block_end], tags)
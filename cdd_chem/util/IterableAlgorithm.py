@@ -7,18 +7,96 @@
    Author: Alberto Gobbi
 """
 
+import itertools
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import typing
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import AbstractContextManager
-from typing import TypeVar, Iterator, Optional, Callable, Generic, List
+from typing import TypeVar, Iterator, Optional, Callable, Generic, List, Deque, Tuple, Any, Dict, TextIO
+
+from cdd_chem.util.parallel import ordered_map, unordered_map
 
 TI = TypeVar('TI')
 TO = TypeVar('TO')
 
 
+class StageStats:
+    """ Counters of one pipeline stage, see IterableAlgorithm.enable_stats.
+
+        Wall and CPU (of the calling thread) time are only measured inside
+        compute / compute_batch so they do not include upstream stages.
+        Latencies are kept for a random sample of maxSamples calls.
+    """
+
+    def __init__(self, maxSamples:int = 10000):
+        self.items_in = 0
+        self.items_out = 0
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.maxSamples = maxSamples
+        self.latencies:List[float] = []
+        self._random = random.Random(0)
+
+    @property
+    def dropped(self) -> int:
+        """ number of input items without output """
+        return self.items_in - self.items_out
+
+    def timed(self, fn:Callable, arg:Any, numItems:int = 1) -> Any:
+        """ call fn(arg) counting numItems input items and its time """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            return fn(arg)
+        finally:
+            cpu = time.thread_time() - cpu
+            wall = time.perf_counter() - wall
+            self.items_in += numItems
+            self.calls += 1
+            self.wall_time += wall
+            self.cpu_time += cpu
+            if len(self.latencies) < self.maxSamples:
+                self.latencies.append(wall)
+            else:
+                # reservoir sampling
+                i = self._random.randrange(self.calls)
+                if i < self.maxSamples:
+                    self.latencies[i] = wall
+
+    def percentile(self, pct:float) -> Optional[float]:
+        """ latency of a compute call in seconds at percentile pct (0-100) """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
 class IterableAlgorithm(Iterator[TO], AbstractContextManager, metaclass=ABCMeta):
     """ An algorithm that supports iterating over the resulting TO objects.
         The interface is an iterator with HasNExt method that also is a context handler """
 
+    # counters of this stage, None unless enable_stats was called
+    stats: Optional[StageStats] = None
+
+    def enable_stats(self, chain:bool = True) -> "IterableAlgorithm[TO]":
+        """ Start recording StageStats for this algorithm and, if chain, for
+            the algorithms of its inItter chain; see pipeline_report.
+            Only algorithms with a compute method (SimpleIterableAlgorithm,
+            BatchIterableAlgorithm) record times.
+        """
+        for alg in (_pipeline_stages(self) if chain else [self]):
+            if isinstance(alg, (SimpleIterableAlgorithm, BatchIterableAlgorithm)):
+                alg.stats = StageStats()
+        return self
+
 
     @abstractmethod
     def has_next(self) -> bool:
@@ -67,9 +145,12 @@ class SimpleIterableAlgorithm(IterableAlgorithm[TO],Generic[TI,TO]):
         if self.nextItem is not None:
             return True
 
+        stats = self.stats
         for nxt in self.inItter:
-            ret = self.compute(nxt)
+            ret = self.compute(nxt) if stats is None else stats.timed(self.compute, nxt)
             if ret is not None:
+                if stats is not None:
+                    stats.items_out += 1
                 self.nextItem = ret
                 return True
 
@@ -97,6 +178,552 @@ class LambdaAlgorithm(SimpleIterableAlgorithm[TI, TO]):
         return item # type: ignore   # this implementation will be overwritten in __init__
 
 
+class BatchingAlgorithm(IterableAlgorithm[List[TI]],Generic[TI]):
+    """ Groups the items of an input algorithm into lists of batchSize items,
+        the last list may be shorter. Use FlattenAlgorithm to return to single items.
+    """
+
+    def __init__(self, inItter:IterableAlgorithm[TI], batchSize:int = 256):
+        if batchSize < 1:
+            raise ValueError(f"batchSize must be at least 1: {batchSize}")
+        self.inItter = inItter
+        self.batchSize = batchSize
+        self.nextItem: Optional[List[TI]] = None
+
+    def __next__(self) -> List[TI]:
+        if not self.has_next():
+            raise StopIteration
+
+        ret = typing.cast(List[TI], self.nextItem)
+        self.nextItem = None
+        return ret
+
+    def has_next(self) -> bool:
+        """ has_next """
+        if self.nextItem is None:
+            self.nextItem = list(itertools.islice(self.inItter, self.batchSize)) or None
+        return self.nextItem is not None
+
+    def __enter__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.inItter.__exit__(*args)
+        super().__exit__(*args)
+
+
+class FlattenAlgorithm(IterableAlgorithm[TO],Generic[TO]):
+    """ Returns the items of the lists returned by an input algorithm, e.g.
+        of a BatchingAlgorithm or BatchIterableAlgorithm
+    """
+
+    def __init__(self, inItter:IterableAlgorithm[List[TO]]):
+        self.inItter = inItter
+        self._pending:Deque[TO] = deque()
+
+    def __next__(self) -> TO:
+        if not self.has_next():
+            raise StopIteration
+        return self._pending.popleft()
+
+    def has_next(self) -> bool:
+        """ has_next """
+        while not self._pending:
+            batch = next(self.inItter, None)
+            if batch is None:
+                return False
+            self._pending.extend(batch)
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.inItter.__exit__(*args)
+        super().__exit__(*args)
+
+
+class BatchIterableAlgorithm(IterableAlgorithm[List[TO]],Generic[TI,TO]):
+    """ Abstract class for algorithms processing lists of TI objects at a time,
+        e.g. to vectorize work across molecules.
+
+        The input algorithm returns lists of TI, e.g. a BatchingAlgorithm, and
+        the output are lists of TO, so that batch algorithms can be chained
+        without per item dispatch; use FlattenAlgorithm to continue with per
+        item algorithms.
+
+        All that needs to be done is to implement the compute_batch method
+    """
+
+    def __init__(self, inItter:IterableAlgorithm[List[TI]]):
+        self.inItter = inItter
+        self.nextItem: Optional[List[TO]] = None
+
+    @abstractmethod
+    def compute_batch(self, items:List[TI]) -> List[Optional[TO]]:
+        """ Overwrite this method returning the results for items.
+            None results are dropped, batches without results are skipped
+        """
+
+    def __next__(self) -> List[TO]:
+        if not self.has_next():
+            raise StopIteration
+
+        ret = typing.cast(List[TO], self.nextItem)
+        self.nextItem = None
+        return ret
+
+    def has_next(self) -> bool:
+        """ has_next """
+        if self.nextItem is not None:
+            return True
+
+        stats = self.stats
+        for batch in self.inItter:
+            ret = self.compute_batch(batch) if stats is None else stats.timed(self.compute_batch, batch, len(batch))
+            ret = [item for item in ret if item is not None]
+            if stats is not None:
+                stats.items_out += len(ret)
+            if ret:
+                self.nextItem = ret
+                return True
+
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.inItter.__exit__(*args)
+        super().__exit__(*args)
+
+
+class LambdaBatchAlgorithm(BatchIterableAlgorithm[TI, TO]):
+    """ Create a BatchIterableAlgorithm using a lambda function that computes a list of TO from a list of TI """
+
+    def __init__(self, inItter:IterableAlgorithm[List[TI]], lmbda:Callable[[List[TI]], List[Optional[TO]]]):
+        super().__init__(inItter)
+        self.compute_batch = lmbda # type: ignore
+
+    def compute_batch(self, items:List[TI]) -> List[Optional[TO]]: # type: ignore
+        return items # type: ignore   # this implementation will be overwritten in __init__
+
+
+class _PrefetchEnd:
+    """ Queued by PrefetchAlgorithm after the last item, error is the
+        exception raised by the input algorithm if any """
+
+    def __init__(self, error:Optional[BaseException] = None):
+        self.error = error
+
+
+class PrefetchAlgorithm(IterableAlgorithm[TO],Generic[TO]):
+    """ Reads the items of an input algorithm on a background thread into a
+        queue of at most depth items, so that reading and parsing overlaps
+        with the work of downstream algorithms.
+
+        The thread is started by the first has_next. Exceptions raised by the
+        input algorithm are raised by has_next / __next__ once the items read
+        before are consumed. close (or leaving the with block) stops the
+        thread before the input algorithm is closed.
+    """
+
+    def __init__(self, inItter:IterableAlgorithm[TO], depth:int = 1000, closeTimeout:float = 1.0):
+        """
+        Parameter
+        --------
+        inItter: input algorithm, only accessed from the background thread
+                 until close
+        depth: maximum number of items read ahead
+        closeTimeout: seconds close waits for the thread before closing inItter
+        """
+        if depth < 1:
+            raise ValueError(f"depth must be at least 1: {depth}")
+        self.inItter = inItter
+        self._queue:queue.Queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread:Optional[threading.Thread] = None
+        self._done = False
+        self._inputClosed = False
+        self.closeTimeout = closeTimeout
+        self.nextItem:Optional[TO] = None
+
+    def _read(self) -> None:
+        try:
+            for item in self.inItter:
+                self._queue.put(item)
+                if self._stop.is_set():
+                    return
+            self._queue.put(_PrefetchEnd())
+        except BaseException as exc: # pylint: disable=W0703
+            self._queue.put(_PrefetchEnd(exc))
+
+    def has_next(self) -> bool:
+        """ has_next, waits for the background thread """
+        if self.nextItem is not None:
+            return True
+        if self._done:
+            return False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._read, name="PrefetchAlgorithm", daemon=True)
+            self._thread.start()
+
+        item = self._queue.get()
+        if isinstance(item, _PrefetchEnd):
+            self._done = True
+            self._thread.join()
+            if item.error is not None:
+                raise item.error
+            return False
+        self.nextItem = item
+        return True
+
+    def __next__(self) -> TO:
+        if not self.has_next():
+            raise StopIteration
+
+        ret = typing.cast(TO, self.nextItem)
+        self.nextItem = None
+        return ret
+
+    def __enter__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def _drain_and_join(self, timeout:float) -> None:
+        """ drop queued items, unblocking the thread waiting for room, until
+            the thread ended or timeout seconds passed """
+        thread = typing.cast(threading.Thread, self._thread)
+        end = time.monotonic() + timeout
+        while thread.is_alive() and time.monotonic() < end:
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            thread.join(0.01)
+
+    def close(self):
+        """ stop the background thread and drop the prefetched items
+
+            If the thread does not stop within closeTimeout seconds, e.g.
+            because the input algorithm waits for items, the input algorithm
+            is closed to unblock it.
+        """
+        self._done = True
+        self.nextItem = None
+        if self._thread is not None:
+            self._stop.set()
+            self._drain_and_join(self.closeTimeout)
+            if self._thread.is_alive():
+                self._inputClosed = True
+                self.inItter.close()
+                self._drain_and_join(self.closeTimeout)
+                if self._thread.is_alive():
+                    logging.warning("PrefetchAlgorithm thread did not stop after closing its input")
+            self._thread = None
+
+    def __exit__(self, *args):
+        self.close()
+        if not self._inputClosed:
+            self.inItter.__exit__(*args)
+
+
+class _TeeBranch(IterableAlgorithm[TO],Generic[TO]):
+    """ One output of a TeeAlgorithm """
+
+    def __init__(self, tee:"TeeAlgorithm[TO]", inItter:IterableAlgorithm[TO]):
+        self.tee = tee
+        self.inItter = inItter
+        self.buffer:Deque[TO] = deque()
+        self.closed = False
+        # thread that last read this branch, the creating thread until read
+        self.reader = threading.get_ident()
+
+    def has_next(self) -> bool:
+        """ has_next, may wait for slower branches """
+        self.reader = threading.get_ident()
+        return self.tee._fill(self) # pylint: disable=W0212
+
+    def __next__(self) -> TO:
+        if not self.has_next():
+            raise StopIteration
+        with self.tee._cond: # pylint: disable=W0212
+            item = self.buffer.popleft()
+            self.tee._cond.notify_all() # pylint: disable=W0212
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        """ stop buffering items for this branch """
+        self.tee._close_branch(self) # pylint: disable=W0212
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TeeAlgorithm(AbstractContextManager, Generic[TO]):
+    """ Splits an input algorithm into n branch algorithms that each return
+        all its items, like itertools.tee, e.g.::
+
+            with TeeAlgorithm(inp, 2) as (sdf_branch, smi_branch):
+
+        Items read but not yet returned by a branch are buffered. Reading
+        from upstream waits while a branch has maxBuffer items buffered, so a
+        slow branch holds back the others instead of the buffer growing: when
+        branches are consumed by one thread they must stay within maxBuffer
+        items of each other, otherwise consume each branch on its own thread
+        or close the branches that are not needed. Instead of waiting forever
+        a RuntimeError is raised if the full branches were last read by (or,
+        if never read, created on) the calling thread. An exception raised by the
+        input algorithm is raised by all branches after their buffered items.
+        The input algorithm is closed when all branches or the TeeAlgorithm are
+        closed.
+
+        run_sinks is a push style alternative feeding output streams and
+        callbacks in a single pass.
+    """
+
+    def __init__(self, inItter:IterableAlgorithm[TO], n:int = 2, maxBuffer:int = 1000):
+        if n < 1:
+            raise ValueError(f"n must be at least 1: {n}")
+        if maxBuffer < 1:
+            raise ValueError(f"maxBuffer must be at least 1: {maxBuffer}")
+        self.inItter = inItter
+        self.maxBuffer = maxBuffer
+        self.branches:List[_TeeBranch[TO]] = [_TeeBranch(self, inItter) for _ in range(n)]
+        self._cond = threading.Condition()
+        self._reading = False
+        self._started = False
+        self._end = False
+        self._error:Optional[BaseException] = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self.branches)
+
+    def __getitem__(self, i:int) -> "_TeeBranch[TO]":
+        return self.branches[i]
+
+    def __iter__(self) -> Iterator["_TeeBranch[TO]"]:
+        return iter(self.branches)
+
+    def _fill(self, branch:"_TeeBranch[TO]") -> bool:
+        """ make sure branch has a buffered item unless the input is exhausted """
+        with self._cond:
+            self._started = True
+            while True:
+                if branch.buffer:
+                    return True
+                if branch.closed:
+                    return False
+                if self._end:
+                    if self._error is not None:
+                        raise self._error
+                    return False
+                full = [b for b in self.branches if not b.closed and len(b.buffer) >= self.maxBuffer]
+                if not self._reading and not full:
+                    break
+                if full and all(b.reader == threading.get_ident() for b in full):
+                    raise RuntimeError(f"TeeAlgorithm branch is {self.maxBuffer} items ahead of a branch read "
+                                       "by the same thread, read the branches on separate threads, "
+                                       "increase maxBuffer or close the lagging branch")
+                self._cond.wait()
+            self._reading = True
+
+        try:
+            item = next(self.inItter)
+            end = False
+        except StopIteration:
+            end = True
+        except BaseException as exc: # pylint: disable=W0703
+            end = True
+            with self._cond:
+                self._error = exc
+
+        with self._cond:
+            self._reading = False
+            if end:
+                self._end = True
+            else:
+                for b in self.branches:
+                    if not b.closed:
+                        b.buffer.append(item)
+            self._cond.notify_all()
+        return self._fill(branch)
+
+    def _close_branch(self, branch:"_TeeBranch[TO]") -> None:
+        with self._cond:
+            branch.closed = True
+            branch.buffer.clear()
+            self._cond.notify_all()
+            if not all(b.closed for b in self.branches):
+                return
+        self.close()
+
+    def run_sinks(self, sinks:List[Any]) -> int:
+        """ Push style tee: read the input algorithm once passing each item to all
+            sinks on the calling thread and return the number of items.
+
+            A sink is an object with a write_mol method, e.g. a BaseMolOutputStream,
+            or a callable taking the item. The sinks are not closed. To overlap
+            slow sinks use one thread per branch instead, or wrap output streams in
+            cdd_chem.io.BackgroundMolOutputStream.
+        """
+        with self._cond:
+            if self._started:
+                raise ValueError("run_sinks can not be mixed with reading branches")
+            self._started = self._end = True
+        writers = [sink.write_mol if hasattr(sink, "write_mol") else sink for sink in sinks]
+        count = 0
+        for item in self.inItter:
+            for write in writers:
+                write(item)
+            count += 1
+        return count
+
+    def close(self):
+        """ close all branches and the input algorithm """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            for b in self.branches:
+                b.closed = True
+                b.buffer.clear()
+            self._cond.notify_all()
+        self.inItter.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParallelMapError(Exception):
+    """ Raised by ParallelMapAlgorithm when fn raised for an item, the
+        original exception is available as cause and __cause__ """
+
+    def __init__(self, index:int, cause:BaseException):
+        super().__init__(index, cause)
+        self.index = index
+        self.cause = cause
+
+    def __str__(self):
+        return f"item {self.index} raised {self.cause!r}"
+
+
+class _ChunkMapper(Generic[TI, TO]):
+    """ Picklable callable applying fn to a chunk of (index, item) """
+
+    def __init__(self, fn:Callable[[TI], Optional[TO]]):
+        self.fn = fn
+
+    def __call__(self, chunk:List[Tuple[int, TI]]) -> List[TO]:
+        res = []
+        for index, item in chunk:
+            try:
+                out = self.fn(item)
+            except Exception as exc: # pylint: disable=W0703
+                raise ParallelMapError(index, exc) from exc
+            if out is not None:
+                res.append(out)
+        return res
+
+
+class ParallelMapAlgorithm(IterableAlgorithm[TO],Generic[TI,TO]):
+    """ Applies fn to the items of an input algorithm on a pool of worker
+        processes or threads.
+
+        Items are sent to the workers in chunks of chunksize. If ordered is
+        True the results are returned in input order and at most window
+        chunks are in flight, which bounds the memory needed for reordering;
+        otherwise results are returned as soon as their chunk is done.
+        As for SimpleIterableAlgorithm.compute items for which fn returns None
+        are dropped. An exception raised by fn is raised as ParallelMapError
+        giving the 0 based index of the item.
+    """
+
+    def __init__(self, inItter:IterableAlgorithm[TI], fn:Callable[[TI], Optional[TO]],
+                 workers:int = 1, ordered:bool = True, chunksize:int = 16,
+                 backend:str = "process", window:Optional[int] = None):
+        """
+        Parameter
+        --------
+        inItter: input algorithm, read on the calling thread
+        fn: function computing the output for one item; must be picklable
+            (e.g. a module level function) for the process backend
+        workers: number of worker processes or threads
+        ordered: return results in input order
+        chunksize: number of items sent to a worker at a time
+        backend: "process" or "thread"; threads only help if fn releases the GIL
+        window: maximum number of chunks in flight, defaults to 4 * workers
+        """
+        if backend not in ("process", "thread"):
+            raise ValueError(f"backend must be 'process' or 'thread': {backend}")
+        if chunksize < 1:
+            raise ValueError(f"chunksize must be at least 1: {chunksize}")
+        self.inItter = inItter
+        self.executor:Executor = ProcessPoolExecutor(max_workers=workers) if backend == "process" \
+                                 else ThreadPoolExecutor(max_workers=workers)
+        items = enumerate(inItter)
+        chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+        mapper = ordered_map if ordered else unordered_map
+        self._results = mapper(self.executor, _ChunkMapper(fn), chunks,
+                               window if window is not None else 4 * workers)
+        self._pending:Deque[TO] = deque()
+
+    def has_next(self) -> bool:
+        """ has_next """
+        while not self._pending:
+            try:
+                self._pending.extend(next(self._results))
+            except StopIteration:
+                return False
+            except ParallelMapError as exc:
+                # the cause is lost when the exception is pickled back from a process
+                raise exc from exc.cause
+        return True
+
+    def __next__(self) -> TO:
+        if not self.has_next():
+            raise StopIteration
+        return self._pending.popleft()
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def close(self):
+        """ cancel pending chunks and stop the workers """
+        self._results.close() # type: ignore
+        self.executor.shutdown()
+        self._pending.clear()
+
+    def __exit__(self, *args):
+        self.close()
+        self.inItter.__exit__(*args)
+
+
 class PushbackIterableAlgorithm(IterableAlgorithm[TO],Generic[TI,TO]):
     """ Wraps an IterableAlgorithm adding the pushback() method
     """
@@ -142,3 +769,61 @@ class PushbackIterableAlgorithm(IterableAlgorithm[TO],Generic[TI,TO]):
 
     def __setattr__(self, attr, value):
         return setattr(self.inItter, attr, value)
+
+
+def _pipeline_stages(alg:IterableAlgorithm) -> List[IterableAlgorithm]:
+    """ alg and the algorithms of its inItter chain, most upstream first """
+    stages = []
+    while isinstance(alg, IterableAlgorithm):
+        stages.append(alg)
+        alg = getattr(alg, 'inItter', None)
+    return stages[::-1]
+
+
+_STDOUT:Any = object()
+
+
+def pipeline_report(alg:IterableAlgorithm, file:Optional[TextIO] = _STDOUT) -> List[Dict[str, Any]]:
+    """ Returns one dict per stage of the inItter chain of alg, most upstream
+        first, with the StageStats recorded after enable_stats and prints them
+        as a table to file unless it is None. file defaults to the sys.stdout
+        of the time of the call.
+
+        Keys: stage, items_in, items_out, dropped, calls, wall_s, cpu_s,
+        items_per_s (items_in per second of wall time in compute),
+        p50_ms, p90_ms, p99_ms (compute latency); None for stages without stats.
+    """
+    rows = []
+    for stage in _pipeline_stages(alg):
+        row:Dict[str, Any] = dict.fromkeys(("items_in", "items_out", "dropped", "calls", "wall_s", "cpu_s",
+                                            "items_per_s", "p50_ms", "p90_ms", "p99_ms"))
+        row["stage"] = type(stage).__name__
+        stats = stage.stats
+        if stats is not None:
+            row.update(items_in=stats.items_in, items_out=stats.items_out, dropped=stats.dropped,
+                       calls=stats.calls, wall_s=stats.wall_time, cpu_s=stats.cpu_time,
+                       items_per_s=stats.items_in / stats.wall_time if stats.wall_time > 0 else None)
+            for pct in (50, 90, 99):
+                latency = stats.percentile(pct)
+                row[f"p{pct}_ms"] = None if latency is None else latency * 1000
+        rows.append(row)
+
+    if file is _STDOUT:
+        file = sys.stdout
+    if file is not None:
+        columns = ["stage", "items_in", "items_out", "dropped", "wall_s", "cpu_s", "items_per_s",
+                   "p50_ms", "p90_ms", "p99_ms"]
+        table = [columns] + [[_format_stat(row[c]) for c in columns] for row in rows]
+        widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+        for line in table:
+            print("  ".join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(line, widths))),
+                  file=file)
+    return rows
+
+
+def _format_stat(value:Any) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
@@ -8,6 +8,7 @@ for each bit
 """
 
 import base64
+from typing import List, Sequence, Union
 
 import numpy
 
@@ -52,3 +53,50 @@ def from_base64(b64_bits: bytes, np_type: type) -> numpy.array:
     packed = numpy.frombuffer(base64.b64decode(b64_bits.strip()), dtype=numpy.uint8)
     int_array = numpy.unpackbits(packed)
     return int_array.astype(np_type)
+
+
+def from_base64_list(b64_bits_list: Sequence[Union[str, bytes]], np_type: type) -> numpy.ndarray:
+    """Convert base64 encoded bit fingerprints of equal length to one 2-D
+       array (one row per fingerprint, one column per bit).
+
+       The decoded bytes are collected in one preallocated array and
+       expanded with a single numpy.unpackbits call.
+
+       Parameters
+       ----------
+       b64_bits_list
+            base64 encoded representations of fingerprints
+       np_type
+            data type for the numpy array to return
+
+        Returns
+        -------
+            numpy array of shape (len(b64_bits_list), number of bits)
+    """
+
+    decoded = [base64.b64decode(b64_bits.strip()) for b64_bits in b64_bits_list]
+    num_bytes = len(decoded[0]) if decoded else 0
+    if any(len(row) != num_bytes for row in decoded):
+        raise ValueError("Fingerprints differ in length")
+    packed = numpy.empty((len(decoded), num_bytes), dtype=numpy.uint8)
+    for i, row in enumerate(decoded):
+        packed[i] = numpy.frombuffer(row, dtype=numpy.uint8)
+    return numpy.unpackbits(packed, axis=1).astype(np_type, copy=False)
+
+
+def to_base64_list(bits: numpy.ndarray) -> List[bytes]:
+    """Convert fingerprints represented as 2-D numpy.array (one row per
+       fingerprint, one column per bit) to base64 encoded strings.
+
+       Parameters
+       ----------
+       bits
+            the fingerprints to convert
+
+       Returns
+       -------
+            base64 encoded representation of each fingerprint, as to_base64
+    """
+
+    packed = numpy.packbits(bits.astype(numpy.short), axis=1)
+    return [base64.b64encode(row.tobytes()) for row in packed]
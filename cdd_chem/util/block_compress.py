@@ -0,0 +1,196 @@
+"""
+
+Block compressed output using a pool of compression threads.
+
+The uncompressed data is cut into fixed size blocks, each block is
+compressed independently into a gzip member or a zstd frame and the
+compressed blocks are written in order. Concatenated gzip members (zstd
+frames) are a valid gzip (zstd) file so the output can be read by any
+standard tool. zlib and zstd release the GIL while compressing which lets
+the threads run in parallel.
+
+zstd compression requires the optional ``zstandard`` package.
+
+"""
+
+import gzip
+import io
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from typing import BinaryIO, Callable, Deque, Optional
+
+# default number of uncompressed bytes per block
+BLOCK_SIZE = 1 << 20
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def compression_method(file_path: str) -> Optional[str]:
+    """Returns "gzip", "zstd" or None depending on the extension of file_path."""
+    if file_path.endswith(".gz"):
+        return "gzip"
+    if file_path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def _compressor(method: str, level: int) -> Callable[[bytes], bytes]:
+    """Returns a thread safe function compressing a block into a gzip member or zstd frame."""
+    if method == "gzip":
+        return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    if method == "zstd":
+        try:
+            import zstandard  # pylint: disable=C0415
+        except ModuleNotFoundError as exc:
+            raise ModuleNotFoundError("zstd compression requires the zstandard package") from exc
+        # ZstdCompressor objects may not be shared between threads
+        local = threading.local()
+
+        def compress(data: bytes) -> bytes:
+            if not hasattr(local, "cctx"):
+                local.cctx = zstandard.ZstdCompressor(level=level, write_content_size=True)
+            return local.cctx.compress(data)
+        return compress
+    raise ValueError(f"Unknown compression method {method}, expected gzip or zstd")
+
+
+def zstd_reader(raw: BinaryIO) -> BinaryIO:
+    """Returns a binary stream decompressing all zstd frames read from raw."""
+    try:
+        import zstandard  # pylint: disable=C0415
+    except ModuleNotFoundError as exc:
+        raise ModuleNotFoundError("zstd decompression requires the zstandard package") from exc
+    return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=False)
+
+
+class BlockCompressWriter(io.BufferedIOBase):
+    """Binary stream compressing blocks of data on a thread pool.
+
+       Blocks are written to the underlying stream in order; at most
+       ``2 * threads`` blocks are in flight at any time.
+    """
+
+    def __init__(self, raw: BinaryIO, method: str = "gzip", level: Optional[int] = None,
+                 threads: int = 1, block_size: int = BLOCK_SIZE, close_raw: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        raw
+            binary stream receiving the compressed blocks
+        method
+            "gzip" or "zstd"
+        level
+            compression level, defaults to 6 for gzip and 3 for zstd
+        threads
+            number of compression threads
+        block_size
+            number of uncompressed bytes per block
+        close_raw
+            close ``raw`` when this stream is closed
+        """
+        super().__init__()
+        self._raw = raw
+        self._compress = _compressor(method, level if level is not None else DEFAULT_LEVELS[method])
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._window = 2 * threads
+        self._block_size = block_size
+        self._close_raw = close_raw
+        self._buf = bytearray()
+        self._pending: Deque[Future] = deque()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:  # type: ignore[override]
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buf += data
+        while len(self._buf) >= self._block_size:
+            self._submit(bytes(self._buf[:self._block_size]))
+            del self._buf[:self._block_size]
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        while len(self._pending) >= self._window:
+            self._write_raw(self._pending.popleft().result())
+        self._pending.append(self._executor.submit(self._compress, block))
+
+    def _drain(self) -> None:
+        while self._pending:
+            self._write_raw(self._pending.popleft().result())
+
+    def _write_raw(self, compressed: bytes) -> None:
+        self._raw.write(compressed)
+
+    def end_block(self) -> None:
+        """Compress the partially filled block now and write all pending
+           blocks, so that the output ends on a member/frame boundary.
+        """
+        if self._buf:
+            self._submit(bytes(self._buf))
+            self._buf.clear()
+        self._drain()
+        self._raw.flush()
+
+    def flush(self) -> None:
+        """Writes the blocks compressed so far; data of a partially filled
+           block stays buffered to avoid creating small blocks.
+        """
+        if not self.closed:
+            while self._pending and self._pending[0].done():
+                self._write_raw(self._pending.popleft().result())
+            self._raw.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.end_block()
+        finally:
+            self._executor.shutdown()
+            super().close()
+            if self._close_raw:
+                self._raw.close()
+
+
+class RecordBlockWriter(BlockCompressWriter):
+    """BlockCompressWriter that treats every write() as one record, never
+       splits a record across blocks and keeps track of where each record
+       is stored.
+
+       After closing, ``block_offsets`` holds the compressed offset of each
+       block followed by the file size, ``record_blocks`` the block number
+       and ``record_offsets`` the uncompressed offset within its block of
+       each record. A block is closed before it would exceed
+       ``block_size``; a single record larger than block_size gets a block of
+       its own.
+    """
+
+    def __init__(self, raw: BinaryIO, method: str = "gzip", level: Optional[int] = None,
+                 threads: int = 1, block_size: int = 1 << 16, close_raw: bool = True) -> None:
+        super().__init__(raw, method, level, threads, block_size, close_raw)
+        self.block_offsets = array('q', [0])
+        self.record_blocks = array('q')
+        self.record_offsets = array('q')
+        self._num_blocks = 0
+
+    def write(self, data) -> int:  # type: ignore[override]
+        if self.closed:
+            raise ValueError("write to closed file")
+        if self._buf and len(self._buf) + len(data) > self._block_size:
+            self._submit(bytes(self._buf))
+            self._buf.clear()
+        self.record_blocks.append(self._num_blocks)
+        self.record_offsets.append(len(self._buf))
+        self._buf += data
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        super()._submit(block)
+        self._num_blocks += 1
+
+    def _write_raw(self, compressed: bytes) -> None:
+        super()._write_raw(compressed)
+        self.block_offsets.append(self.block_offsets[-1] + len(compressed))
@@ -0,0 +1,76 @@
+"""
+
+Helpers for running work on concurrent.futures executors while keeping
+results in input order.
+
+"""
+
+from collections import deque
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
+from typing import Callable, Deque, Iterable, Iterator, Set, TypeVar
+
+TI = TypeVar('TI')
+TO = TypeVar('TO')
+
+
+def ordered_map(executor: Executor, fn: Callable[[TI], TO],
+                items: Iterable[TI], window: int) -> Iterator[TO]:
+    """Apply ``fn`` to all ``items`` on ``executor`` and yield the results
+       in input order.
+
+       At most ``window`` tasks are submitted but not yet consumed, this
+       bounds the memory needed for results that finish out of order.
+       Exceptions raised by ``fn`` are re-raised when the corresponding
+       result is reached. Tasks that have not started are cancelled if the
+       generator is closed early.
+
+       Parameters
+       ----------
+       executor
+           thread or process pool executing ``fn``
+       fn
+           function to apply, must be picklable for process pools
+       items
+           input items, consumed lazily
+       window
+           maximum number of pending tasks
+
+       Returns
+       -------
+           iterator over ``fn(item)`` in the order of ``items``
+    """
+    pending: Deque[Future] = deque()
+    try:
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def unordered_map(executor: Executor, fn: Callable[[TI], TO],
+                  items: Iterable[TI], window: int) -> Iterator[TO]:
+    """Like ordered_map but yield the results as soon as they are done.
+
+       At most ``window`` tasks are pending; a slow task does not hold back
+       the results of tasks submitted after it.
+    """
+    pending: Set[Future] = set()
+    try:
+        for item in items:
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(fn, item))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,431 @@
+"""
+
+Toolkit independent helpers for handling SD files at the byte level.
+
+A record of an SD file is everything up to and including the terminating
+``$$$$`` line. These functions split files into records without building
+molecules so that the records can be handed to a toolkit later, possibly in
+another thread or process.
+
+"""
+
+import logging
+import mmap
+import os
+import zlib
+from array import array
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+import numpy
+
+RECORD_TERMINATOR = b"$$$$"
+
+# default number of bytes read per call when splitting a stream
+READ_SIZE = 1 << 20
+
+
+def find_record_end(buf, start: int = 0, at_eof: bool = True) -> int:
+    """Find the end of the SD record starting at ``start``.
+
+       Parameters
+       ----------
+       buf
+           bytes, bytearray or mmap holding SD file content; ``start`` must
+           be at the beginning of a line
+       start
+           offset at which to start searching for the ``$$$$`` line
+       at_eof
+           True if ``buf`` holds the remainder of the file; if False a
+           ``$$$$`` line that is not terminated by a newline is not accepted
+           because more data might follow
+
+       Returns
+       -------
+           offset just past the newline of the ``$$$$`` line, or -1 if no
+           complete terminator was found
+    """
+    pos = start
+    while True:
+        idx = buf.find(RECORD_TERMINATOR, pos)
+        if idx < 0:
+            return -1
+        if idx == start or buf[idx - 1] == 0x0A:
+            eol = buf.find(b"\n", idx + len(RECORD_TERMINATOR))
+            if eol < 0:
+                if not at_eof:
+                    return -1
+                eol = len(buf) - 1
+            if not bytes(buf[idx + len(RECORD_TERMINATOR):eol + 1]).strip():
+                return eol + 1
+        pos = idx + len(RECORD_TERMINATOR)
+
+
+def iter_sd_records(stream: BinaryIO, read_size: int = READ_SIZE) -> Iterator[bytes]:
+    """Split a binary stream of SD file content into records.
+
+       Parameters
+       ----------
+       stream
+           binary file object positioned at the start of a record
+       read_size
+           number of bytes to read from ``stream`` at a time
+
+       Returns
+       -------
+           iterator over the records including their ``$$$$`` line; trailing
+           content without terminator is returned as last record unless it
+           is whitespace only
+    """
+    buf = b""
+    pos = 0
+    scan = 0
+    eof = False
+    while True:
+        end = find_record_end(buf, pos, eof) if scan == pos else _find_from(buf, pos, scan, eof)
+        if end >= 0:
+            yield buf[pos:end]
+            pos = scan = end
+            continue
+        if eof:
+            rest = buf[pos:]
+            if rest.strip():
+                yield rest
+            return
+        chunk = stream.read(read_size)
+        buf = buf[pos:] + chunk
+        # do not rescan content of long records, keep a few bytes for a partial terminator
+        scan = max(0, len(buf) - len(chunk) - len(RECORD_TERMINATOR) - 2)
+        pos = 0
+        if not chunk:
+            eof = True
+            scan = 0
+
+
+def _find_from(buf: bytes, start: int, scan: int, at_eof: bool) -> int:
+    """find_record_end for a record starting at ``start`` skipping the scan of ``buf[start:scan]``"""
+    line_start = buf.rfind(b"\n", start, scan) + 1
+    if line_start <= start:
+        return find_record_end(buf, start, at_eof)
+    return find_record_end(buf, line_start, at_eof)
+
+
+def scan_record_offsets(buf, start: int = 0, end: Optional[int] = None) -> numpy.ndarray:
+    """Find the byte offsets of all records in ``buf[start:end]``.
+
+       Parameters
+       ----------
+       buf
+           bytes or mmap holding SD file content
+       start
+           offset of the first record
+       end
+           offset at which to stop; records starting before ``end`` are
+           included completely
+
+       Returns
+       -------
+           int64 array with the start offset of each record followed by the
+           end offset of the last record
+    """
+    if end is None:
+        end = len(buf)
+    offsets = array('q', [start])
+    pos = start
+    while pos < end:
+        nxt = find_record_end(buf, pos)
+        if nxt < 0:
+            if bytes(buf[pos:]).strip():
+                offsets.append(len(buf))
+            elif len(offsets) == 1:
+                offsets[0] = len(buf)
+            break
+        offsets.append(nxt)
+        pos = nxt
+    return numpy.frombuffer(offsets, dtype=numpy.int64)
+
+
+class SDFileIndex:
+    """Byte offsets of the records of an uncompressed SD file.
+
+       The index is stored in a sidecar file next to the SD file and reused
+       as long as the size and modification time of the SD file match the
+       values recorded in the sidecar.
+    """
+
+    SUFFIX = ".cddidx"
+    _VERSION = 1
+
+    def __init__(self, file_path: str, offsets: numpy.ndarray) -> None:
+        self.file_path = file_path
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def record_range(self, i: int) -> Tuple[int, int]:
+        """Returns start and end offset of record ``i``."""
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    @classmethod
+    def load_or_build(cls, file_path: str, save: bool = True) -> "SDFileIndex":
+        """Load the sidecar index of ``file_path`` or build it if it does not
+           exist or is out of date.
+
+           Parameters
+           ----------
+           file_path
+               uncompressed SD file
+           save
+               write a newly built index to the sidecar file; failure to
+               write (e.g. a read only directory) is logged but not fatal
+        """
+        stat = os.stat(file_path)
+        idx_path = file_path + cls.SUFFIX
+        if os.path.exists(idx_path):
+            try:
+                data = numpy.load(idx_path)
+                if (data[0] == cls._VERSION and data[1] == stat.st_size
+                        and data[2] == stat.st_mtime_ns):
+                    return cls(file_path, data[3:])
+            except (OSError, ValueError, IndexError) as exc:
+                logging.warning("Ignoring unreadable index %s: %s", idx_path, exc)
+
+        offsets = numpy.zeros(1, dtype=numpy.int64)
+        if stat.st_size > 0:
+            with open(file_path, "rb") as in_f, \
+                 mmap.mmap(in_f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                offsets = scan_record_offsets(buf)
+        index = cls(file_path, offsets)
+        if save:
+            index.save(stat)
+        return index
+
+    def save(self, stat: Optional[os.stat_result] = None) -> None:
+        """Write this index to the sidecar file."""
+        if stat is None:
+            stat = os.stat(self.file_path)
+        header = numpy.array([self._VERSION, stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+        idx_path = self.file_path + self.SUFFIX
+        tmp_path = f"{idx_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as out:
+                numpy.save(out, numpy.concatenate([header, self.offsets]))
+            os.replace(tmp_path, idx_path)
+        except OSError as exc:
+            logging.warning("Could not write index %s: %s", idx_path, exc)
+
+
+def record_start_at_or_after(buf, pos: int) -> int:
+    """Returns the first record boundary at or after byte offset ``pos``.
+
+       Record boundaries are the start of the file and the positions just
+       past each ``$$$$`` line.
+    """
+    if pos <= 0:
+        return 0
+    if pos >= len(buf):
+        return len(buf)
+    line_start = buf.rfind(b"\n", 0, pos - 1) + 1
+    end = find_record_end(buf, line_start)
+    return len(buf) if end < 0 else end
+
+
+def shard_byte_range(buf, shard: int, num_shards: int) -> Tuple[int, int]:
+    """Returns the byte range of the records belonging to ``shard``.
+
+       The file is cut into ``num_shards`` ranges of equal byte size and
+       each cut is moved forward to the next record boundary. A shard holds
+       the records starting within its range so that every record belongs
+       to exactly one shard.
+
+       Parameters
+       ----------
+       buf
+           bytes or mmap holding the SD file content
+       shard
+           0 based shard number
+       num_shards
+           total number of shards
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"shard ({shard}) must be in [0, num_shards ({num_shards}))")
+    size = len(buf)
+    return (record_start_at_or_after(buf, size * shard // num_shards),
+            record_start_at_or_after(buf, size * (shard + 1) // num_shards))
+
+
+def iter_sd_records_in_range(buf, start: int, end: int) -> Iterator[bytes]:
+    """Yields the records of ``buf`` starting at or after ``start`` and before
+       ``end``; ``start`` must be a record boundary.
+    """
+    pos = start
+    while pos < end:
+        nxt = find_record_end(buf, pos)
+        if nxt < 0:
+            nxt = len(buf)
+            if not bytes(buf[pos:nxt]).strip():
+                return
+        yield buf[pos:nxt]
+        pos = nxt
+
+
+def iter_sd_record_batches(buf, start: int = 0, end: Optional[int] = None,
+                           batch_size: int = 64) -> Iterator[memoryview]:
+    """Yields zero copy views of ``buf`` each holding up to ``batch_size``
+       consecutive records starting at or after ``start`` and before ``end``.
+
+       Record boundaries are found with ``find`` on ``buf`` (e.g. an mmap),
+       no data is copied until the caller converts a view.
+    """
+    if end is None:
+        end = len(buf)
+    view = memoryview(buf)
+    try:
+        pos = start
+        while pos < end:
+            batch_end = pos
+            for _ in range(batch_size):
+                if batch_end >= end:
+                    break
+                nxt = find_record_end(buf, batch_end)
+                if nxt < 0:
+                    if not bytes(view[batch_end:]).strip():
+                        end = batch_end
+                        break
+                    nxt = len(buf)
+                batch_end = nxt
+            if batch_end > pos:
+                yield view[pos:batch_end]
+            pos = batch_end
+    finally:
+        view.release()
+
+
+class BlockSDFileIndex:
+    """Record index of a block compressed SD file (.sdf.bgz).
+
+       Such a file is a sequence of gzip members ("blocks") each holding
+       complete records. The index stores the compressed offset of every
+       block and, for every record, the block number and the uncompressed
+       offset within the block. It is kept in a sidecar file that is reused
+       as long as size and modification time of the SD file are unchanged.
+    """
+
+    SUFFIX = ".cddidx"
+    _VERSION = 1
+
+    def __init__(self, file_path: str, block_offsets: numpy.ndarray,
+                 record_blocks: numpy.ndarray, record_offsets: numpy.ndarray) -> None:
+        """
+        Parameters
+        ----------
+        file_path
+            block compressed SD file
+        block_offsets
+            compressed offset of each block followed by the file size
+        record_blocks
+            block number of each record
+        record_offsets
+            uncompressed offset of each record within its block
+        """
+        self.file_path = file_path
+        self.block_offsets = numpy.asarray(block_offsets, dtype=numpy.int64)
+        self.record_blocks = numpy.asarray(record_blocks, dtype=numpy.int64)
+        self.record_offsets = numpy.asarray(record_offsets, dtype=numpy.int64)
+        # first record of each block followed by the number of records
+        self.block_records = numpy.searchsorted(self.record_blocks, numpy.arange(self.num_blocks + 1))
+
+    def __len__(self) -> int:
+        return len(self.record_blocks)
+
+    @property
+    def num_blocks(self) -> int:
+        """Number of compressed blocks."""
+        return len(self.block_offsets) - 1
+
+    def block_range(self, block: int) -> Tuple[int, int]:
+        """Returns the start and end offset of the compressed block."""
+        return int(self.block_offsets[block]), int(self.block_offsets[block + 1])
+
+    def record_location(self, i: int) -> Tuple[int, int]:
+        """Returns the block number and in-block offset of record ``i``."""
+        return int(self.record_blocks[i]), int(self.record_offsets[i])
+
+    @classmethod
+    def load_or_build(cls, file_path: str, save: bool = True) -> "BlockSDFileIndex":
+        """Load the sidecar index of ``file_path`` or build it by scanning the
+           gzip members of the file if it does not exist or is out of date.
+        """
+        stat = os.stat(file_path)
+        idx_path = file_path + cls.SUFFIX
+        if os.path.exists(idx_path):
+            try:
+                with numpy.load(idx_path) as data:
+                    header = data["header"]
+                    if (header[0] == cls._VERSION and header[1] == stat.st_size
+                            and header[2] == stat.st_mtime_ns):
+                        return cls(file_path, data["block_offsets"], data["record_blocks"], data["record_offsets"])
+            except (OSError, ValueError, KeyError) as exc:
+                logging.warning("Ignoring unreadable index %s: %s", idx_path, exc)
+
+        with open(file_path, "rb") as in_f:
+            index = cls(file_path, *_scan_blocks(in_f))
+        if save:
+            index.save(stat)
+        return index
+
+    def save(self, stat: Optional[os.stat_result] = None) -> None:
+        """Write this index to the sidecar file."""
+        if stat is None:
+            stat = os.stat(self.file_path)
+        header = numpy.array([self._VERSION, stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+        idx_path = self.file_path + self.SUFFIX
+        tmp_path = f"{idx_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as out:
+                numpy.savez(out, header=header, block_offsets=self.block_offsets,
+                            record_blocks=self.record_blocks, record_offsets=self.record_offsets)
+            os.replace(tmp_path, idx_path)
+        except OSError as exc:
+            logging.warning("Could not write index %s: %s", idx_path, exc)
+
+
+def _scan_blocks(in_f: BinaryIO) -> Tuple[array, array, array]:
+    """Find the gzip members and the records within them by decompressing
+       the whole file once.
+    """
+    block_offsets = array('q', [0])
+    record_blocks = array('q')
+    record_offsets = array('q')
+    decomp = zlib.decompressobj(wbits=31)
+    block = bytearray()
+    chunk_start = 0
+    chunk = in_f.read(READ_SIZE)
+    while chunk:
+        block += decomp.decompress(chunk)
+        if not decomp.eof:
+            chunk_start += len(chunk)
+            chunk = in_f.read(READ_SIZE)
+            continue
+
+        member_end = chunk_start + len(chunk) - len(decomp.unused_data)
+        pos = 0
+        while pos < len(block):
+            end = find_record_end(block, pos)
+            if end < 0:
+                if bytes(block[pos:]).strip():
+                    raise ValueError(f"Record spans gzip members at offset {block_offsets[-1]},"
+                                     " file is not record aligned")
+                break
+            record_blocks.append(len(block_offsets) - 1)
+            record_offsets.append(pos)
+            pos = end
+        block_offsets.append(member_end)
+
+        chunk = decomp.unused_data
+        chunk_start = member_end
+        decomp = zlib.decompressobj(wbits=31)
+        block = bytearray()
+        if not chunk:
+            chunk = in_f.read(READ_SIZE)
+    return block_offsets, record_blocks, record_offsets
@@ -0,0 +1,44 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Test file for cdd_chem module.
+"""
+
+import gzip
+import io
+
+import pytest
+
+from cdd_chem.util.block_compress import BlockCompressWriter, zstd_reader
+
+DATA = b"".join(b"line %d of some compressible text\n" % i for i in range(5000))
+
+
+def test_gzip_blocks():
+    raw = io.BytesIO()
+    with BlockCompressWriter(raw, "gzip", level=1, threads=3, block_size=1000, close_raw=False) as out:
+        for i in range(0, len(DATA), 777):
+            out.write(DATA[i:i + 777])
+    assert gzip.decompress(raw.getvalue()) == DATA
+    # every block is a separate gzip member
+    assert raw.getvalue().count(b"\x1f\x8b\x08") >= len(DATA) // 1000
+
+
+def test_end_block():
+    raw = io.BytesIO()
+    out = BlockCompressWriter(raw, "gzip", threads=2, close_raw=False)
+    out.write(DATA[:100])
+    out.end_block()
+    assert gzip.decompress(raw.getvalue()) == DATA[:100]
+    out.write(DATA[100:])
+    out.close()
+    assert gzip.decompress(raw.getvalue()) == DATA
+
+
+def test_zstd_blocks():
+    pytest.importorskip("zstandard")
+    raw = io.BytesIO()
+    with BlockCompressWriter(raw, "zstd", threads=2, block_size=1000, close_raw=False) as out:
+        out.write(DATA)
+    raw.seek(0)
+    assert zstd_reader(raw).read() == DATA
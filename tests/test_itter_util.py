@@ -3,6 +3,16 @@ Created on Mar 2, 2019
 
 @author: albertgo
 '''
+import io
+import threading
+import time
+
+import pytest
+
+from cdd_chem.io import BoundedMemMolStream, MemMolStream
+from cdd_chem.util.IterableAlgorithm import BatchingAlgorithm, BatchIterableAlgorithm, FlattenAlgorithm
+from cdd_chem.util.IterableAlgorithm import LambdaAlgorithm, LambdaBatchAlgorithm, ParallelMapAlgorithm, ParallelMapError
+from cdd_chem.util.IterableAlgorithm import PrefetchAlgorithm, TeeAlgorithm, pipeline_report
 from cdd_chem.util.iterate import PushbackIterator
 
 
@@ -21,3 +31,152 @@ def test_pushback_iter():
     pb_it.pushback('z')
     assert pb_it.has_next()
     assert pb_it.__next__() == 'z'
+
+
+def _square_odd(i):
+    if i == 13:
+        raise KeyError(i)
+    return i * i if i % 2 else None
+
+
+def test_parallel_map():
+    for backend in ("process", "thread"):
+        with ParallelMapAlgorithm(MemMolStream(list(range(13))), _square_odd, workers=2, chunksize=3,
+                                  backend=backend) as alg:
+            assert list(alg) == [i * i for i in range(1, 13, 2)]
+
+        with ParallelMapAlgorithm(MemMolStream(list(range(13))), _square_odd, workers=2, chunksize=2,
+                                  ordered=False, backend=backend) as alg:
+            assert sorted(alg) == [i * i for i in range(1, 13, 2)]
+
+        with ParallelMapAlgorithm(MemMolStream(list(range(20))), _square_odd, workers=2, chunksize=4,
+                                  backend=backend) as alg:
+            with pytest.raises(ParallelMapError) as exc_info:
+                list(alg)
+            assert exc_info.value.index == 13
+            assert isinstance(exc_info.value.__cause__, KeyError)
+
+
+class _Negate(BatchIterableAlgorithm[int, int]):
+    def compute_batch(self, items):
+        return [-i if i % 3 else None for i in items]
+
+
+def test_batch_algorithms():
+    with BatchingAlgorithm(MemMolStream(list(range(10))), 4) as alg:
+        assert list(alg) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+    with FlattenAlgorithm(_Negate(BatchingAlgorithm(MemMolStream(list(range(10))), 3))) as alg:
+        assert list(alg) == [-1, -2, -4, -5, -7, -8]
+
+    # 3 and 6 are dropped by _Negate so its second batch is skipped
+    chain = LambdaBatchAlgorithm(_Negate(BatchingAlgorithm(MemMolStream([1, 2, 3, 6]), 2)),
+                                 lambda items: [i * 10 for i in items])
+    with FlattenAlgorithm(chain) as alg:
+        assert list(alg) == [-10, -20]
+    assert not chain.has_next()
+
+
+def test_pipeline_report(capsys):
+    odd = LambdaAlgorithm(MemMolStream(list(range(10))), lambda i: i if i % 2 else None)
+    alg = FlattenAlgorithm(_Negate(BatchingAlgorithm(odd, 2)))
+    alg.enable_stats()
+    assert list(alg) == [-1, -5, -7]
+
+    out = io.StringIO()
+    rows = pipeline_report(alg, out)
+    assert [row["stage"] for row in rows] == ["MemMolStream", "LambdaAlgorithm", "BatchingAlgorithm",
+                                              "_Negate", "FlattenAlgorithm"]
+    assert (rows[1]["items_in"], rows[1]["items_out"], rows[1]["dropped"]) == (10, 5, 5)
+    assert (rows[3]["items_in"], rows[3]["items_out"], rows[3]["calls"]) == (5, 3, 3)
+    assert rows[3]["p50_ms"] <= rows[3]["p99_ms"]
+    assert rows[0]["items_in"] is None
+    assert "_Negate" in out.getvalue()
+
+    # the default file is the current sys.stdout, None only returns the rows
+    pipeline_report(alg)
+    assert "_Negate" in capsys.readouterr().out
+    assert pipeline_report(alg, None) == rows
+    assert capsys.readouterr().out == ""
+
+
+class _Failing(MemMolStream):
+    def __next__(self):
+        item = super().__next__()
+        if item == 5:
+            raise KeyError(item)
+        return item
+
+
+def test_prefetch():
+    with PrefetchAlgorithm(MemMolStream(list(range(100))), depth=3) as alg:
+        assert list(alg) == list(range(100))
+        assert not alg.has_next()
+
+    with PrefetchAlgorithm(_Failing(list(range(10))), depth=2) as alg:
+        assert [next(alg) for _ in range(5)] == list(range(5))
+        with pytest.raises(KeyError):
+            alg.has_next()
+
+    # leaving the with block early stops the thread blocked on the full queue
+    with PrefetchAlgorithm(MemMolStream(list(range(100))), depth=2) as alg:
+        assert next(alg) == 0
+        thread = alg._thread # pylint: disable=W0212
+    assert not thread.is_alive()
+
+    # an input waiting for items is closed to stop the thread
+    stream = BoundedMemMolStream()
+    stream.add_mol(1)
+    with PrefetchAlgorithm(stream, depth=2, closeTimeout=0.1) as alg:
+        assert next(alg) == 1
+        thread = alg._thread # pylint: disable=W0212
+    assert not thread.is_alive()
+
+
+def test_tee():
+    with TeeAlgorithm(MemMolStream(list(range(10))), 2, maxBuffer=3) as (first, second):
+        assert [next(first) for _ in range(3)] == [0, 1, 2]
+        assert [next(second) for _ in range(6)] == list(range(6))
+        assert [next(first) for _ in range(6)] == list(range(3, 9))
+        assert list(second) == list(range(6, 10))
+        assert list(first) == [9]
+
+    # reading one branch more than maxBuffer ahead on a single thread
+    with TeeAlgorithm(MemMolStream(list(range(10))), 2, maxBuffer=3) as (first, second):
+        assert [next(first) for _ in range(3)] == [0, 1, 2]
+        with pytest.raises(RuntimeError):
+            next(first)
+
+    # a slow branch on another thread holds back the fast one
+    tee = TeeAlgorithm(MemMolStream(list(range(200))), 3, maxBuffer=5)
+    results = [[] for _ in tee]
+    lags = []
+
+    def consume(i):
+        for item in tee[i]:
+            results[i].append(item)
+            if i == 0:
+                lags.append(max(len(b.buffer) for b in tee))
+            else:
+                time.sleep(0.0001)
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(len(tee))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [list(range(200))] * 3
+    assert max(lags) <= 5
+
+    # closed branches do not hold back the others
+    with TeeAlgorithm(_Failing(list(range(10))), 2, maxBuffer=1) as (first, second):
+        second.close()
+        assert [next(first) for _ in range(5)] == list(range(5))
+        with pytest.raises(KeyError):
+            first.has_next()
+
+    seen = []
+    tee = TeeAlgorithm(MemMolStream(list(range(10))))
+    assert tee.run_sinks([seen.append, lambda i: seen.append(-i)]) == 10
+    assert seen[:4] == [0, 0, 1, -1]
+    assert not tee[0].has_next()
@@ -4,12 +4,26 @@
 Test file for cdd_chem module.
 """
 
+import asyncio
+import gzip
 import os
+import shutil
+import threading
 
+import pandas
+import pytest
 import pytest_check as check
 
+from cdd_chem.aio import aget_mol_input_stream, aget_mol_output_stream
+from cdd_chem.io import get_mol_input_stream, get_mol_output_stream, merge_shard_outputs
+from cdd_chem.io import BackgroundMolOutputStream, BoundedMemMolStream, CheckpointMolInputStream, CheckpointMolOutputStream
+from cdd_chem.io import dataframe_from_sd_file, dataframe_to_sd_file, iter_dataframes_from_sd_file
+from cdd_chem.mol import from_smiles
+from cdd_chem.toolkit import cdd_toolkit
+from cdd_chem.util.sd_file import iter_sd_records, SDFileIndex, BlockSDFileIndex
+
 try:
-    from cdd_chem.rdkit.io import MolInputStream
+    from cdd_chem.rdkit.io import MolInputStream, MolOutputStream
 except ModuleNotFoundError as exc:
     raise ModuleNotFoundError("RDKit Toolkit not found, cannot run this test") from exc
 
@@ -44,3 +58,417 @@ def test_read_c5(shared_datadir):
         for atom in mol.atoms:
             atomic_sum += atom.atomic_num
     check.equal(11, atomic_sum)
+
+
+def test_read_parallel(shared_datadir):
+    file_name = os.path.join(shared_datadir / 'test_CCCO_confs.sdf')
+    with cdd_toolkit("rdkit"):
+        with get_mol_input_stream(file_name) as inf:
+            expected = [(mol.title, mol.num_atoms, dict(mol.items())) for mol in inf]
+        with get_mol_input_stream(file_name, workers=2, batch_size=2) as inf:
+            check.is_true(inf.has_next())
+            result = [(mol.title, mol.num_atoms, dict(mol.items())) for mol in inf]
+            check.is_false(inf.has_next())
+    check.equal(expected, result)
+
+
+def _numbered_sd_file(shared_datadir, tmp_path, copies: int) -> str:
+    """ write copies of test_CCCO_confs.sdf with titles mol0, mol1, ... """
+    with open(shared_datadir / 'test_CCCO_confs.sdf', 'rb') as in_f:
+        records = list(iter_sd_records(in_f))
+    file_name = str(tmp_path / 'numbered.sdf')
+    with open(file_name, 'wb') as out:
+        for i in range(copies * len(records)):
+            record = records[i % len(records)]
+            out.write(f"mol{i}".encode() + record[record.index(b"\n"):])
+    return file_name
+
+
+def test_random_access(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 4)
+    # plain iteration and truth tests do not build an index
+    with MolInputStream(file_name) as inf:
+        check.is_true(inf)
+        check.equal(20, len(list(inf)))
+    check.is_false(os.path.exists(file_name + SDFileIndex.SUFFIX))
+    with open(file_name, "rb") as in_f, gzip.open(file_name + ".gz", "wb") as out_f:
+        shutil.copyfileobj(in_f, out_f)
+    with MolInputStream(file_name + ".gz") as inf:
+        check.is_true(inf)
+
+    with MolInputStream(file_name) as inf:
+        check.equal(20, inf.num_records())
+        check.equal("mol7", inf[7].title)
+        check.equal("mol19", inf[-1].title)
+        check.equal(["mol2", "mol5", "mol8"], [mol.title for mol in inf[2:9:3]])
+        inf.seek(17)
+        check.equal(["mol17", "mol18", "mol19"], [mol.title for mol in inf])
+        inf.seek(3)
+        check.equal("mol3", next(inf).title)
+    check.is_true(os.path.exists(file_name + SDFileIndex.SUFFIX))
+
+    # index is reused from sidecar file
+    with MolInputStream(file_name) as inf:
+        check.equal(20, inf.num_records())
+        check.equal("mol11", inf[11].title)
+
+
+def test_read_shards(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 5)
+    num_shards = 4
+    shard_files = []
+    with cdd_toolkit("rdkit"):
+        for shard in range(num_shards):
+            shard_files.append(str(tmp_path / f"shard{shard}.sdf.gz"))
+            with get_mol_input_stream(file_name, shard=shard, num_shards=num_shards) as inf, \
+                 get_mol_output_stream(shard_files[-1]) as out:
+                for mol in inf:
+                    out.write_mol(mol)
+        merge_shard_outputs(shard_files, str(tmp_path / "merged.sdf"))
+        with get_mol_input_stream(str(tmp_path / "merged.sdf")) as inf:
+            titles = [mol.title for mol in inf]
+        check.equal([f"mol{i}" for i in range(25)], titles)
+
+        # recompressed from gzip to zstd and back
+        merge_shard_outputs(shard_files, str(tmp_path / "merged.sdf.zst"))
+        merge_shard_outputs([str(tmp_path / "merged.sdf.zst")], str(tmp_path / "merged2.sdf"))
+        with get_mol_input_stream(str(tmp_path / "merged.sdf.zst")) as inf:
+            check.equal(titles, [mol.title for mol in inf])
+        with open(tmp_path / "merged.sdf", "rb") as expected, open(tmp_path / "merged2.sdf", "rb") as merged:
+            check.equal(expected.read(), merged.read())
+
+
+def test_read_smiles(tmp_path):
+    file_name = str(tmp_path / "test.smi")
+    with open(file_name, "w", encoding="UTF-8") as out:
+        out.write("CCO ethanol\n\nc1ccccc1\nCN1CCC[C@H]1c1cccnc1\tnicotine (S)\n")
+
+    with MolInputStream(file_name) as inf:
+        mols = [(mol.title, mol.canonical_smiles) for mol in inf]
+    check.equal([("ethanol", "CCO"), ("", "c1ccccc1"), ("nicotine (S)", "CN1CCC[C@H]1c1cccnc1")], mols)
+
+    with MolInputStream(file_name, batch_size=1, threads=2) as inf:
+        check.equal(mols, [(mol.title, mol.canonical_smiles) for mol in inf])
+
+
+@pytest.mark.parametrize("suffix", [".sdf.gz", ".sdf.zst"])
+def test_write_block_compressed(shared_datadir, tmp_path, suffix):
+    if suffix.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 20)
+    out_name = str(tmp_path / f"out{suffix}")
+    with MolInputStream(file_name) as inf, \
+         MolOutputStream(out_name, compress_threads=2, compress_level=1) as out:
+        for mol in inf:
+            out.write_mol(mol)
+    with MolInputStream(out_name) as inf:
+        check.equal([f"mol{i}" for i in range(100)], [mol.title for mol in inf])
+
+
+def test_block_sd_file(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 20)
+    out_name = str(tmp_path / "out.sdf.bgz")
+    with cdd_toolkit("rdkit"):
+        with get_mol_input_stream(file_name) as inf, \
+             get_mol_output_stream(out_name, compress_threads=2, block_size=4096) as out:
+            for mol in inf:
+                out.write_mol(mol)
+        index = BlockSDFileIndex.load_or_build(out_name)
+        check.equal(100, len(index))
+        check.greater(index.num_blocks, 1)
+
+        titles = [f"mol{i}" for i in range(100)]
+        with get_mol_input_stream(out_name, threads=2) as inf:
+            check.equal(titles, [mol.title for mol in inf])
+            check.equal(100, inf.num_records())
+            check.equal("mol42", inf[42].title)
+            check.equal(titles[57:63], [mol.title for mol in inf[57:63]])
+            inf.seek(90)
+            check.equal(titles[90:], [mol.title for mol in inf])
+
+    # plain gzip readers see the concatenated records
+    with gzip.open(out_name) as in_f:
+        check.equal(100, in_f.read().count(b"$$$$"))
+
+
+def test_async_streams(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 10)
+    out_name = str(tmp_path / "out.sdf.gz")
+
+    async def copy():
+        async with await aget_mol_input_stream(file_name, batch_size=7, readahead=3) as inf, \
+                   await aget_mol_output_stream(out_name, batch_size=5) as out:
+            async for mol in inf:
+                await out.write_mol(mol)
+
+    with cdd_toolkit("rdkit"):
+        asyncio.run(copy())
+        with get_mol_input_stream(out_name) as inf:
+            check.equal([f"mol{i}" for i in range(50)], [mol.title for mol in inf])
+
+
+def test_background_writer(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 10)
+    out_name = str(tmp_path / "out.sdf")
+    with cdd_toolkit("rdkit"):
+        with get_mol_input_stream(file_name) as inf, \
+             get_mol_output_stream(out_name, writer_queue_size=2) as out:
+            out.write_mols(inf)
+        with get_mol_input_stream(out_name) as inf:
+            check.equal([f"mol{i}" for i in range(50)], [mol.title for mol in inf])
+
+        # errors of the writer thread are raised on close
+        out = get_mol_output_stream(out_name, writer_queue_size=2)
+        out.write_mol("not a molecule")
+        with pytest.raises(AttributeError):
+            out.close()
+
+        # after an error no further molecules are written
+        with get_mol_input_stream(file_name) as inf:
+            mols = list(inf)
+        out = BackgroundMolOutputStream(get_mol_output_stream(out_name), queue_size=1, batch_size=1)
+        out.write_mols(mols[:3])
+        out.write_mol("not a molecule")
+        with pytest.raises(AttributeError):
+            for mol in mols[3:]:
+                out.write_mol(mol)
+        with pytest.raises(AttributeError):
+            out.write_mol(mols[0])
+        with pytest.raises(AttributeError):
+            out.close()
+        with get_mol_input_stream(out_name) as inf:
+            check.equal(["mol0", "mol1", "mol2"], [mol.title for mol in inf])
+
+
+def test_parquet(shared_datadir, tmp_path):
+    pytest.importorskip("pyarrow")
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 10)
+    out_name = str(tmp_path / "out.parquet")
+    with cdd_toolkit("rdkit"):
+        with get_mol_input_stream(file_name) as inf:
+            mols = list(inf)
+        for mol in mols:
+            mol["idx"] = mol.title[3:]
+        with get_mol_output_stream(out_name, row_group_size=16) as out:
+            out.write_mols(mols)
+
+        table = pandas.read_parquet(out_name, columns=["title", "idx"])
+        check.equal(list(range(50)), table["idx"].tolist())
+        check.equal("int64", str(table["idx"].dtype))
+
+        with get_mol_input_stream(out_name) as inf:
+            read = list(inf)
+        check.equal([mol.title for mol in mols], [mol.title for mol in read])
+        check.equal([mol.canonical_smiles for mol in mols], [mol.canonical_smiles for mol in read])
+        check.equal("7", read[7]["idx"])
+
+        # without the mol column molecules are parsed from the SMILES
+        with get_mol_input_stream(out_name, columns=["idx"]) as inf:
+            read = list(inf)
+        check.equal([from_smiles(mol.canonical_smiles).canonical_smiles for mol in mols],
+                    [mol.canonical_smiles for mol in read])
+        check.equal("7", read[7]["idx"])
+
+
+def test_cddb_archive(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 10)
+    out_name = str(tmp_path / "out.cddb")
+    with cdd_toolkit("rdkit"):
+        with get_mol_input_stream(file_name) as inf:
+            mols = list(inf)
+        with get_mol_output_stream(out_name, chunk_size=4096, compress_threads=2) as out:
+            out.write_mols(mols)
+
+        with get_mol_input_stream(out_name, threads=2) as inf:
+            check.greater(inf.num_chunks, 1)
+            check.equal(50, len(inf))
+            read = list(inf)
+        check.equal([mol.title for mol in mols], [mol.title for mol in read])
+        check.equal([mol.mol_file for mol in mols], [mol.mol_file for mol in read])
+        check.equal(dict(mols[3].items()), dict(read[3].items()))
+
+        with cdd_toolkit("openeye"), pytest.raises(ValueError):
+            get_mol_input_stream(out_name)
+
+
+def test_read_memory_map(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 10)
+    with MolInputStream(file_name) as inf:
+        expected = [(mol.title, mol.mol_file) for mol in inf]
+    with MolInputStream(file_name, memory_map=True, batch_size=7) as inf:
+        check.equal(expected, [(mol.title, mol.mol_file) for mol in inf])
+        inf.seek(45)
+        check.equal(expected[45:], [(mol.title, mol.mol_file) for mol in inf])
+    with pytest.raises(ValueError):
+        MolInputStream(str(tmp_path / "numbered.sdf.gz"), memory_map=True)
+
+
+def test_iter_dataframes(shared_datadir, tmp_path):
+    file_name = str(tmp_path / "test.sdf")
+    with open(shared_datadir / 'test.sdf', 'rb') as in_f, open(file_name, 'wb') as out:
+        out.write(in_f.read() * 7)
+    with cdd_toolkit("rdkit"):
+        expected = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0)
+        chunks = list(iter_dataframes_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0, chunksize=4))
+    check.equal([4, 4, 4, 4, 4, 1], [len(chunk) for chunk in chunks])
+    pandas.testing.assert_frame_equal(expected, pandas.concat(chunks))
+
+
+def test_dataframe_to_sd_file_parallel(shared_datadir, tmp_path):
+    with cdd_toolkit("rdkit"):
+        data = dataframe_from_sd_file(os.path.join(shared_datadir / 'test.sdf'), "SMILES", 0, "ID", id_index=0)
+        data = pandas.concat([data] * 5, ignore_index=True)
+        dataframe_to_sd_file(data, "SMILES", "ID", str(tmp_path / "serial.sdf"))
+        dataframe_to_sd_file(data, "SMILES", "ID", str(tmp_path / "parallel.sdf.gz"), workers=2, chunk_size=4)
+        pandas.testing.assert_frame_equal(
+            dataframe_from_sd_file(str(tmp_path / "serial.sdf"), "SMILES", 0, "ID", id_index=0),
+            dataframe_from_sd_file(str(tmp_path / "parallel.sdf.gz"), "SMILES", 0, "ID", id_index=0))
+
+        for suffix in (".sdf.bgz", ".smi"):
+            with pytest.raises(ValueError):
+                dataframe_to_sd_file(data, "SMILES", "ID", str(tmp_path / f"parallel{suffix}"), workers=2)
+
+
+def test_dataframe_columns_where(shared_datadir):
+    file_name = os.path.join(shared_datadir / 'test.sdf')
+    with cdd_toolkit("rdkit"):
+        data = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0)
+        selected = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0,
+                                          columns=["AromaticRings", "AliphaticRings"],
+                                          where="AromaticRings > 0")
+        check.equal(["ID", "SMILES", "AliphaticRings", "AromaticRings"], list(selected.columns))
+        expected = data.loc[data["AromaticRings"] > 0, list(selected.columns)].reset_index(drop=True)
+        check.greater(len(data), len(expected))
+        pandas.testing.assert_frame_equal(expected, selected)
+
+        selected = dataframe_from_sd_file(file_name, None, None, "ID", id_index=0,
+                                          where=lambda tags: tags["AromaticRings"] > 0)
+        check.equal(len(expected), len(selected))
+
+        # empty and missing tags compare False
+        check.equal(0, len(data.loc[data["c_pKa"] != ""]))
+        check.equal(0, len(dataframe_from_sd_file(file_name, "SMILES", 0, where="c_pKa > 6")))
+        check.equal(0, len(dataframe_from_sd_file(file_name, "SMILES", 0, where="NoSuchTag > 6")))
+        check.equal(len(data), len(dataframe_from_sd_file(file_name, "SMILES", 0,
+                                                          where="not NoSuchTag > 6 and abs(Charge) < 99")))
+
+
+def test_dataframe_schema(shared_datadir):
+    file_name = os.path.join(shared_datadir / 'test.sdf')
+    with cdd_toolkit("rdkit"):
+        data = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0)
+        check.equal("Int64", str(data["AromaticRings"].dtype))
+        check.equal("Float64", str(data["cLogP"].dtype))
+
+        schema = data.dtypes.astype(str).to_dict()
+        pandas.testing.assert_frame_equal(data, dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0,
+                                                                       schema=schema))
+        data = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0, sample_size=1,
+                                      schema={"AromaticRings": "Float64", "cLogP": "string"})
+        check.equal("Float64", str(data["AromaticRings"].dtype))
+        check.equal("string", str(data["cLogP"].dtype))
+
+        with pytest.raises(ValueError):
+            dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0, schema={"cLogP": "Int64"})
+
+
+def test_dataframe_schema_qualified_values(tmp_path):
+    file_name = str(tmp_path / "qualified.sdf")
+    with cdd_toolkit("rdkit"):
+        with get_mol_output_stream(file_name) as out:
+            for value in ["1", "2.5", "3", ">10", "", "<0.1"]:
+                mol = from_smiles("C")
+                mol["act"] = value
+                out.write_mol(mol)
+
+        # values after the sample that are not numbers are kept
+        data = dataframe_from_sd_file(file_name, None, None, sample_size=3)
+        check.equal(["1.0", "2.5", "3.0", ">10", "", "<0.1"], data["act"].tolist())
+        pandas.testing.assert_frame_equal(data, dataframe_from_sd_file(file_name, None, None))
+        with pytest.raises(ValueError):
+            dataframe_from_sd_file(file_name, None, None, schema={"act": "Float64"})
+
+
+def test_dataframe_from_sd_file_workers(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 4)
+    with cdd_toolkit("rdkit"):
+        for kwargs in ({}, {"where": "Total_energy < -6", "columns": ["Total_energy"]}):
+            data = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0, **kwargs)
+            pandas.testing.assert_frame_equal(
+                data, dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0, workers=2, **kwargs))
+        check.equal([f"mol{i}" for i in range(20)],
+                    dataframe_from_sd_file(file_name, None, None, "ID", id_index=0, workers=3)["ID"].tolist())
+
+        with pytest.raises(ValueError):
+            dataframe_from_sd_file(file_name + ".gz", "SMILES", 0, workers=2)
+
+
+def test_bounded_mem_stream():
+    with cdd_toolkit("rdkit"):
+        stream = BoundedMemMolStream(maxsize=2)
+        stream.add_mol(from_smiles("C"))
+        stream.add_mol(from_smiles("CC"))
+        with pytest.raises(TimeoutError):
+            stream.add_mol(from_smiles("CCC"), timeout=0.01)
+
+        def produce():
+            for i in range(3, 20):
+                stream.add_mol(from_smiles("C" * i))
+            stream.close_input()
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        sizes = [mol.num_atoms for mol in stream]
+        producer.join()
+        check.equal([1, 2] + list(range(3, 20)), sizes)
+        check.is_false(stream.has_next())
+        with pytest.raises(ValueError):
+            stream.add_mol(from_smiles("C"))
+
+        stream = BoundedMemMolStream(maxsize=1)
+        stream.add_mol(from_smiles("C"))
+        errors = []
+
+        def blocked():
+            try:
+                stream.add_mol(from_smiles("CC"))
+            except ValueError as exc:
+                errors.append(exc)
+
+        producer = threading.Thread(target=blocked)
+        producer.start()
+        stream.close()
+        producer.join()
+        check.equal(1, len(errors))
+
+
+def test_checkpoint_resume(shared_datadir, tmp_path):
+    file_name = _numbered_sd_file(shared_datadir, tmp_path, 4)
+    out_name = str(tmp_path / "out.sdf")
+    with cdd_toolkit("rdkit"):
+        with pytest.raises(KeyError):
+            with CheckpointMolInputStream(get_mol_input_stream(file_name)) as inp, \
+                 CheckpointMolOutputStream(out_name, inp, checkpoint_every=3) as out:
+                for mol in inp:
+                    if mol.title == "mol7":
+                        raise KeyError(mol.title)
+                    out.write_mol(mol)
+        check.is_true(os.path.exists(out_name + ".ckpt"))
+
+        for in_name in (file_name, file_name + ".gz"):
+            if in_name.endswith(".gz"):
+                with open(file_name, "rb") as in_f, gzip.open(in_name, "wb") as out_f:
+                    out_f.write(in_f.read())
+                shutil.copy(out_name + ".bak", out_name)
+                shutil.copy(out_name + ".ckpt.bak", out_name + ".ckpt")
+            else:
+                shutil.copy(out_name, out_name + ".bak")
+                shutil.copy(out_name + ".ckpt", out_name + ".ckpt.bak")
+            with CheckpointMolInputStream(get_mol_input_stream(in_name)) as inp, \
+                 CheckpointMolOutputStream(out_name, inp, checkpoint_every=3, resume=True) as out:
+                check.equal(6, out.input_records)
+                for mol in inp:
+                    out.write_mol(mol)
+            check.is_false(os.path.exists(out_name + ".ckpt"))
+            with get_mol_input_stream(out_name) as inp:
+                check.equal([f"mol{i}" for i in range(20)], [mol.title for mol in inp])
@@ -0,0 +1,92 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Test file for cdd_chem module.
+"""
+
+import gzip
+import io
+import os
+
+import pytest
+
+from cdd_chem.util.block_compress import RecordBlockWriter
+from cdd_chem.util.sd_file import iter_sd_records, find_record_end, SDFileIndex, BlockSDFileIndex
+from cdd_chem.util.sd_file import shard_byte_range, iter_sd_records_in_range, iter_sd_record_batches
+
+
+RECORDS = [b"mol1\n\n\n  0  0  0  0  0  0  0  0  0  0999 V2000\nM  END\n> <a>\n$$$$ x\n\n$$$$\n",
+           b"mol2\n\n\nM  END\n$$$$\r\n",
+           b"mol3\n\n\nM  END\n$$$$"]
+
+
+def test_find_record_end():
+    data = b"".join(RECORDS)
+    assert find_record_end(data) == len(RECORDS[0])
+    assert find_record_end(data, len(RECORDS[0])) == len(RECORDS[0]) + len(RECORDS[1])
+    assert find_record_end(data[:-1]) == len(RECORDS[0])
+    assert find_record_end(b"mol3\n$$$$", 0, at_eof=False) == -1
+
+
+def test_iter_sd_records():
+    data = b"".join(RECORDS)
+    for read_size in (1, 3, 7, 1000):
+        assert list(iter_sd_records(io.BytesIO(data), read_size)) == RECORDS
+    assert list(iter_sd_records(io.BytesIO(data + b"\n \n"), 5)) == RECORDS[:2] + [RECORDS[2] + b"\n"]
+    assert list(iter_sd_records(io.BytesIO(b"mol\nM  END\n"))) == [b"mol\nM  END\n"]
+
+
+def test_sd_file_index(tmp_path):
+    file_name = str(tmp_path / "t.sdf")
+    with open(file_name, "wb") as out:
+        out.write(b"".join(RECORDS[:2]) + RECORDS[2] + b"\n")
+    index = SDFileIndex.load_or_build(file_name)
+    assert len(index) == 3
+    assert index.record_range(1) == (len(RECORDS[0]), len(RECORDS[0]) + len(RECORDS[1]))
+    assert os.path.exists(file_name + SDFileIndex.SUFFIX)
+    assert list(SDFileIndex.load_or_build(file_name).offsets) == list(index.offsets)
+
+    # sidecar is rebuilt when the file changes
+    with open(file_name, "ab") as out:
+        out.write(RECORDS[1])
+    assert len(SDFileIndex.load_or_build(file_name)) == 4
+
+
+def test_shard_byte_range():
+    data = b"".join(RECORDS)
+    for num_shards in range(1, len(data) + 2):
+        records = []
+        for shard in range(num_shards):
+            start, end = shard_byte_range(data, shard, num_shards)
+            records.extend(iter_sd_records_in_range(data, start, end))
+        assert records == RECORDS
+
+
+def test_block_sd_file_index(tmp_path):
+    file_name = str(tmp_path / "t.sdf.bgz")
+    with RecordBlockWriter(open(file_name, "wb"), block_size=len(RECORDS[1])) as out:
+        for record in RECORDS:
+            out.write(record)
+    assert list(out.record_blocks) == [0, 1, 2]
+
+    index = BlockSDFileIndex.load_or_build(file_name, save=False)
+    assert list(index.block_offsets) == list(out.block_offsets)
+    assert list(index.record_offsets) == [0, 0, 0]
+    with open(file_name, "rb") as in_f:
+        start, end = index.block_range(1)
+        in_f.seek(start)
+        assert gzip.decompress(in_f.read(end - start)) == RECORDS[1]
+
+    # a record split across gzip members cannot be indexed
+    with open(file_name, "wb") as out_f:
+        out_f.write(gzip.compress(RECORDS[0][:5]) + gzip.compress(RECORDS[0][5:]))
+    with pytest.raises(ValueError):
+        BlockSDFileIndex.load_or_build(file_name, save=False)
+
+
+def test_iter_sd_record_batches():
+    data = b"".join(RECORDS) + b"\n\n"
+    batches = [bytes(view) for view in iter_sd_record_batches(data, batch_size=2)]
+    assert batches == [RECORDS[0] + RECORDS[1], RECORDS[2] + b"\n"]
+    batches = [bytes(view) for view in iter_sd_record_batches(data, len(RECORDS[0]), batch_size=5)]
+    assert batches == [RECORDS[1] + RECORDS[2] + b"\n"]
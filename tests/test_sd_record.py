@@ -0,0 +1,66 @@
+"""
+(C) 2020 Genentech. All rights reserved.
+
+Test file for cdd_chem module.
+"""
+
+import os
+
+import pandas
+import pytest_check as check
+
+from cdd_chem.io import RawSDRecordInputStream, dataframe_from_sd_file, get_mol_input_stream
+from cdd_chem.sd_record import parse_sd_record
+from cdd_chem.toolkit import cdd_toolkit
+
+RECORD = (b"ethanol\n  -OEChem-\n\n  3  2  0     0  0  0  0  0  0999 V2000\n"
+          b"    0.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0\n"
+          b"    1.0000    0.0000    0.0000 C   0  0  0  0  0  0  0  0  0  0  0  0\n"
+          b"    1.5000    0.8660    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0\n"
+          b"  1  2  1  0  0  0  0\n  2  3  1  0  0  0  0\nM  END\n"
+          b">  <pIC50>  (1)\n 6.5\n\n> <empty>\n\n> <multi>\nline 1\nline 2\n\n$$$$\n")
+
+
+def test_parse_sd_record():
+    record = parse_sd_record(RECORD)
+    check.equal("ethanol", record.title)
+    check.equal({"pIC50": " 6.5", "empty": "", "multi": "line 1\nline 2"}, record.tags)
+    check.is_true(record.molblock.endswith("M  END\n"))
+    check.equal(" 6.5", record["pIC50"])
+    check.is_false(record.is_parsed)
+
+    record["new"] = "1"
+    del record["empty"]
+    record.title = "ETOH"
+    check.equal(RECORD.decode()
+                .replace("ethanol", "ETOH")
+                .replace(">  <pIC50>  (1)", "> <pIC50>")
+                .replace("> <empty>\n\n", "")
+                .replace("$$$$", "> <new>\n1\n\n$$$$"),
+                record.sdf_record)
+
+
+def test_lazy_mol():
+    with cdd_toolkit("rdkit"):
+        record = parse_sd_record(RECORD)
+        record["new"] = "1"
+        check.equal(3, record.num_atoms)
+        check.is_true(record.is_parsed)
+        check.equal("CCO", record.canonical_smiles)
+        check.equal("1", record["new"])
+        check.equal("ethanol", record.title)
+
+
+def test_raw_stream(shared_datadir):
+    file_name = os.path.join(shared_datadir / 'test.sdf')
+    with cdd_toolkit("rdkit"):
+        with RawSDRecordInputStream(file_name) as raw, get_mol_input_stream(file_name) as inf:
+            for record, mol in zip(raw, inf):
+                check.equal(mol.title, record.title)
+                check.equal({kee: mol[kee] for kee in mol.keys()}, dict(record.items()))
+            check.is_false(raw.has_next())
+
+        data = dataframe_from_sd_file(file_name, None, None, "ID", id_index=0)
+        check.equal(["ID", "AliphaticRings"], list(data.columns[:2]))
+        smiles_data = dataframe_from_sd_file(file_name, "SMILES", 0, "ID", id_index=0)
+        pandas.testing.assert_frame_equal(data, smiles_data.drop(columns="SMILES"))
@@ -15,3 +15,13 @@ def test_encode():
 def test_decode():
     result = bit_vector.from_base64(b"UY5lpg==", numpy.float32)
     assert numpy.array_equal(result, test_array)
+
+def test_decode_list():
+    result = bit_vector.from_base64_list([b"UY5lpg==", "AAAAAA==\n"], numpy.uint8)
+    assert result.shape == (2, 32)
+    assert numpy.array_equal(result[0], test_array)
+    assert not result[1].any()
+
+def test_encode_list():
+    result = bit_vector.to_base64_list(numpy.vstack([test_array, numpy.zeros(32)]))
+    assert result == [b"UY5lpg==", b"AAAAAA=="]